@@ -1,8 +1,31 @@
 """A class represnting a node in an AVL tree"""
 
+import gc
+import mmap
+import operator
+import os
+import pickle
+import struct
+import sys
+import time
+import weakref
+from array import array
+from bisect import bisect_left
+from collections import Counter, namedtuple
+from heapq import heappop, heappush
+from itertools import count
+
+try:
+	import numpy
+except ImportError:  # optional, FrozenAVLTree.search_many falls back to plain lists
+	numpy = None
+
 class AVLNode(object):
-	"""Constructor, you are allowed to add more fields. 
-	
+	# fixed attribute layout - nodes carry no per-instance __dict__
+	__slots__ = ('key', 'value', 'left', 'right', 'parent', 'height', 'size', 'epoch', 'agg', 'generation')
+
+	"""Constructor, you are allowed to add more fields.
+
 	@type key: int
 	@param key: key of your node
 	@type value: string
@@ -16,6 +39,10 @@ class AVLNode(object):
 		self.right = None
 		self.parent = None
 		self.height = -1
+		self.size = 0  # number of real nodes in the subtree rooted at self
+		self.epoch = 0  # the tree epoch the node was created in, see AVLTree.own
+		self.agg = None  # the aggregate of the subtree's values when the tree keeps one
+		self.generation = 0  # bumped whenever the node is pooled for reuse, see Cursor.sync
 		
 
 	"""returns whether self is not a virtual node 
@@ -82,22 +109,510 @@ class AVLNode(object):
 		return count
 
 
+"""
+Counters of the rebalancing work an AVLTree does, kept while AVLTree.enable_stats is on.
+"""
+
+class AVLStats(object):
+	__slots__ = ('rotations', 'promotions', 'demotions', 'search_paths', 'finger_climbs',
+		'delete_rebalance_loops', 'allocations', 'pool_reuses', 'pool_returns', 'gc_collections',
+		'gc_pause_total', 'gc_pause_max', 'gc_started', '__weakref__')
+
+	# the counters of every tree with stats on, see gc_callback
+	watching = weakref.WeakSet()
+
+	"""
+	Constructor.
+	@complexity: O(1) worst case
+	"""
+	def __init__(self):
+		self.reset()
+
+
+	"""sets all the counters back to zero"""
+	def reset(self):
+		self.rotations = {'single_left': 0, 'single_right': 0, 'double_left_right': 0, 'double_right_left': 0}
+		self.promotions = 0
+		self.demotions = 0
+		# histograms - path length (or climb distance, loop iterations) -> number of operations
+		self.search_paths = Counter()
+		self.finger_climbs = Counter()
+		self.delete_rebalance_loops = Counter()
+		# node allocations, and the nodes taken from and given back to the node pool
+		self.allocations = 0
+		self.pool_reuses = 0
+		self.pool_returns = 0
+		# collections of the cyclic garbage collector (of the whole process) and their pauses in seconds
+		self.gc_collections = 0
+		self.gc_pause_total = 0.0
+		self.gc_pause_max = 0.0
+		self.gc_started = None
+
+
+	"""records the start or the end of a collection of the garbage collector
+
+	@type phase: string
+	@param phase: 'start' or 'stop'
+	@type now: float
+	@param now: time.perf_counter() at the event
+	"""
+	def gc_event(self, phase, now):
+		if phase == 'start':
+			self.gc_started = now
+		elif self.gc_started is not None:
+			pause = now - self.gc_started
+			self.gc_started = None
+			self.gc_collections += 1
+			self.gc_pause_total += pause
+			self.gc_pause_max = max(self.gc_pause_max, pause)
+
+
+	"""returns the counters as plain dicts
+
+	@rtype: dict
+	@returns: rotations by case and their total, promotions, demotions, and the histograms
+	search_path_lengths (search and finger_search), finger_climb_distances (finger_search and
+	finger_insert) and delete_rebalance_iterations (per delete), the node allocations and pool
+	reuses and returns, and the number, total and maximal pause (in seconds) of the gc collections
+	"""
+	def as_dict(self):
+		return {
+			'rotations': dict(self.rotations),
+			'rotations_total': sum(self.rotations.values()),
+			'promotions': self.promotions,
+			'demotions': self.demotions,
+			'search_path_lengths': dict(sorted(self.search_paths.items())),
+			'finger_climb_distances': dict(sorted(self.finger_climbs.items())),
+			'delete_rebalance_iterations': dict(sorted(self.delete_rebalance_loops.items())),
+			'allocations': self.allocations,
+			'pool_reuses': self.pool_reuses,
+			'pool_returns': self.pool_returns,
+			'gc_collections': self.gc_collections,
+			'gc_pause_total': self.gc_pause_total,
+			'gc_pause_max': self.gc_pause_max,
+		}
+
+
+"""times the collections of the garbage collector for the AVLStats being watched, registered in
+gc.callbacks by the first AVLTree.enable_stats. the counters are only weakly referenced, so trees
+dropped with stats on are no longer timed
+
+@type phase: string
+@param phase: 'start' or 'stop'
+@type info: dict
+@param info: the details gc passes to its callbacks
+"""
+def gc_callback(phase, info):
+	now = time.perf_counter()
+	for counters in list(AVLStats.watching):
+		counters.gc_event(phase, now)
+
+
+# an associative aggregate of the values: combine(identity, x) == combine(x, identity) == x,
+# lift(value) is the aggregate of a single value
+Monoid = namedtuple('Monoid', ('identity', 'combine', 'lift'))
+
+
+def lift_value(value):
+	return value
+
+
+def lift_one(value):
+	return 1
+
+
+"""the smaller of two aggregates, None stands for the empty range"""
+def min_of(a, b):
+	if a is None:
+		return b
+	if b is None or not b < a:
+		return a
+	return b
+
+
+"""the larger of two aggregates, None stands for the empty range"""
+def max_of(a, b):
+	if a is None:
+		return b
+	if b is None or not a < b:
+		return a
+	return b
+
+
 """
 A class implementing an AVL tree.
 """
 
 class AVLTree(object):
+	# insert_many/delete_many rebuild the whole tree once the batch is at least 1/BULK_REBUILD_RATIO of it
+	BULK_REBUILD_RATIO = 2
+
+	# source of unique epochs for trees that have taken snapshots
+	epochs = count(1)
+
+	# the class of the real nodes, subclasses of AVLNode add augmented fields
+	node_class = AVLNode
+
+	# dump file header: magic, version, byte order, key typecode, value encoding, number of items
+	DUMP_MAGIC = b'AVLT'
+	DUMP_VERSION = 1
+	DUMP_HEADER = struct.Struct('<4sBcccQ')
+
+	# the aggregate presets, see the constructor
+	AGGREGATES = {
+		'sum': Monoid(0, operator.add, lift_value),
+		'count': Monoid(0, operator.add, lift_one),
+		'min': Monoid(None, min_of, lift_value),
+		'max': Monoid(None, max_of, lift_value),
+	}
 
 	"""
 	Constructor, you are allowed to add more fields.
+
+	@type finger: string
+	@param finger: the default finger of finger_search and finger_insert -
+	'max' (the maximal node), 'min' (the minimal node), 'minmax' (the min or the max, whichever
+	is on the key's side of the root) or 'last' (the last node found or inserted through a finger)
+	@type aggregate: string or tuple
+	@param aggregate: an aggregate of the values every node keeps for its subtree, see aggregate -
+	one of the AGGREGATES presets 'sum', 'count', 'min' and 'max', or an (identity, combine, lift)
+	triple where combine is associative. None keeps no aggregate
 	@complexity: O(1) worst case
 	"""
-	def __init__(self):
+	def __init__(self, finger='max', aggregate=None):
+		if finger not in ('max', 'min', 'minmax', 'last'):
+			raise ValueError("unknown finger mode: %r" % (finger,))
+		if aggregate is not None and not isinstance(aggregate, tuple):
+			if aggregate not in AVLTree.AGGREGATES:
+				raise ValueError("unknown aggregate: %r" % (aggregate,))
+			aggregate = AVLTree.AGGREGATES[aggregate]
 		self.root = None
 		self.maxNode = None
 		self.ext_leaf = AVLNode(None,None)
 		self.minNode = None
 		self.treeSize = 0
+		self.fingerMode = finger
+		self.lastNode = None
+		self.epoch = 0  # nodes of another epoch may be shared with a snapshot, see own
+		self.counters = None  # an AVLStats while enable_stats is on
+		self.pool = None  # deleted nodes waiting for reuse while enable_pool is on
+		self.modcount = 0  # bumped by every change to the node structure, see Cursor
+		self.pool_capacity = 0
+		self.monoid = Monoid(*aggregate) if aggregate is not None else None
+		if self.monoid is not None:
+			self.ext_leaf.agg = self.monoid.identity
+
+
+	"""builds a dictionary from items that are already sorted by key, without any rebalancing
+
+	@type items: iterable
+	@param items: (key, value) pairs in strictly increasing key order, may be a generator
+	@type n: int
+	@param n: the number of items, needed to stream a generator without materializing it
+	@param aggregate: the aggregate the tree keeps, as in the constructor
+	@type gc_freeze: bool
+	@param gc_freeze: True to build with the cyclic garbage collector paused and move the new nodes
+	(and every other object alive at that point) to the permanent generation with gc.freeze(),
+	so later collections no longer traverse them
+	@rtype: AVLTree
+	@returns: a perfectly height-balanced tree holding the items. ValueError is raised if the keys
+	are not strictly increasing or if there are not exactly n items
+	@complexity: O(n), one key comparison per item
+	"""
+	@classmethod
+	def from_sorted(cls, items, n=None, aggregate=None, gc_freeze=False):
+		tree = cls(aggregate=aggregate)
+		if n is None:
+			try:
+				n = len(items)
+			except TypeError:  # no length known - the items have to be counted first
+				items = list(items)
+				n = len(items)
+
+		gc_enabled = gc.isenabled()
+		if gc_freeze:
+			gc.disable()
+		try:
+			nodes = tree.sorted_nodes(items)
+			root = tree.build_balanced(nodes, n)
+			if next(nodes, None) is not None:
+				raise ValueError("got more than the %d items expected" % n)
+			tree.set_root(root)
+		finally:
+			if gc_freeze:
+				gc.freeze()
+				if gc_enabled:
+					gc.enable()
+		return tree
+
+
+	"""builds a dictionary from items in any order
+
+	@type items: iterable
+	@param items: (key, value) pairs, if a key appears more than once its last value is kept
+	@param aggregate: the aggregate the tree keeps, as in the constructor
+	@type gc_freeze: bool
+	@param gc_freeze: as in from_sorted
+	@rtype: AVLTree
+	@returns: a perfectly height-balanced tree holding the items
+	@complexity: O(n log n) for the sort, O(n) for the build
+	"""
+	@classmethod
+	def from_unsorted(cls, items, aggregate=None, gc_freeze=False):
+		pairs = dict(items)
+		return cls.from_sorted(sorted(pairs.items(), key=lambda item: item[0]), len(pairs), aggregate, gc_freeze)
+
+
+	"""loads a dictionary written by dump
+
+	@type path: string
+	@param path: the dump file
+	@rtype: AVLTree
+	@returns: a perfectly height-balanced tree holding the dumped items
+	@complexity: O(n), the items are streamed from the mapped file into from_sorted
+	"""
+	@classmethod
+	def load(cls, path):
+		with MappedAVLTree(path) as view:
+			return cls.from_sorted(view.items(), len(view))
+
+
+	"""creates a new node for every item, checking that the keys are strictly increasing
+
+	@type items: iterable
+	@param items: (key, value) pairs
+	@rtype: generator
+	@returns: a generator of new AVLNodes, it raises ValueError on a key that is not larger than the previous one
+	@complexity: O(1) per item
+	"""
+	def sorted_nodes(self, items):
+		prev = None
+		for key, val in items:
+			if prev is not None and not prev.key < key:
+				raise ValueError("keys must be strictly increasing, got %r after %r" % (key, prev.key))
+			prev = self.new_node(key, val)
+			yield prev
+
+
+	"""links the next n nodes of an in-order node iterator into a balanced subtree
+
+	@type nodes: iterator
+	@param nodes: AVLNodes in increasing key order, consumed in order
+	@type n: int
+	@param n: how many nodes to take from the iterator
+	@rtype: AVLNode
+	@returns: the root of the new subtree (the external leaf if n is 0)
+	@complexity: O(n), recursion depth O(log n)
+	"""
+	def build_balanced(self, nodes, n):
+		if n == 0:
+			return self.ext_leaf
+
+		left_count = (n - 1) // 2
+		left = self.build_balanced(nodes, left_count)
+		node = next(nodes, None)
+		if node is None:
+			raise ValueError("expected %d more items" % (n - left_count))
+		right = self.build_balanced(nodes, n - left_count - 1)
+
+		node = self.own(node, detached=True)
+		node.left = left
+		node.right = right
+		node.parent = None
+		if left.is_real_node():
+			left.parent = node
+		if right.is_real_node():
+			right.parent = node
+		node.height = max(left.height, right.height) + 1
+		self.refresh(node)
+		return node
+
+
+	"""makes a detached subtree the whole dictionary, recomputing the min and max pointers
+
+	@type root: AVLNode
+	@param root: the root of the subtree, None or a virtual node for an empty dictionary
+	@complexity: O(log n)
+	"""
+	def set_root(self, root):
+		self.modcount += 1
+		if root is None or not root.is_real_node():
+			self.root = None
+			self.minNode = None
+			self.maxNode = None
+			self.treeSize = 0
+			self.lastNode = None
+			return
+
+		root.parent = None
+		self.root = root
+		self.treeSize = root.size
+		self.lastNode = None  # may have been removed by the caller
+
+		node = root
+		while node.left.is_real_node():
+			node = node.left
+		self.minNode = node
+
+		node = root
+		while node.right.is_real_node():
+			node = node.right
+		self.maxNode = node
+
+
+	"""creates a new real leaf, not yet linked into the tree, reusing a pooled node if there is one
+
+	@type key: int
+	@param key: key of the new node
+	@type val: string
+	@param val: value of the new node
+	@rtype: AVLNode
+	@returns: a node of height 0 whose children are the external leaf
+	@complexity: O(1)
+	"""
+	def new_node(self, key, val):
+		if self.pool:
+			node = self.pool.pop()
+			node.key = key
+			node.value = val
+			if self.counters is not None:
+				self.counters.pool_reuses += 1
+		else:
+			node = self.node_class(key, val)
+			if self.counters is not None:
+				self.counters.allocations += 1
+		node.left = self.ext_leaf  # left child is external leaf
+		node.right = self.ext_leaf  # right child is external leaf
+		node.height = 0  # it will be a leaf
+		node.size = 1
+		node.epoch = self.epoch
+		if self.monoid is not None:
+			node.agg = self.monoid.lift(val)
+		return node
+
+
+	"""recomputes the fields of a node that are derived from its children (the subtree size and aggregate)
+
+	@type node: AVLNode
+	@param node: a real node whose children are up to date
+	@complexity: O(1)
+	"""
+	def refresh(self, node):
+		node.size = node.left.size + node.right.size + 1
+		if self.monoid is not None:
+			combine = self.monoid.combine
+			node.agg = combine(combine(node.left.agg, self.monoid.lift(node.value)), node.right.agg)
+
+
+	"""refreshes every node on the path from node up to the root
+
+	@type node: AVLNode
+	@param node: the lowest node whose subtree changed, may be None
+	@complexity: O(log n)
+	"""
+	def refresh_path(self, node):
+		while node is not None:
+			self.refresh(node)
+			node = node.parent
+
+
+	"""returns a version of node that self may modify, copying it (and its path) if it is shared
+
+	once snapshot() is called, every node that existed at that moment belongs to the snapshot as well.
+	such nodes have an older epoch than the tree and are never modified again - the first write to one
+	copies it, and since its parent has to point at the copy, the parent is copied too, up to the first
+	node that was already copied (path copying). only the parent pointers are private to the tree
+	(snapshots never follow them), so they are updated in place on shared nodes as well.
+
+	@type node: AVLNode
+	@param node: a real node of self
+	@type detached: bool
+	@param detached: if True the node is about to be relinked from scratch, so its parent
+	and children are not updated to point at the copy
+	@rtype: AVLNode
+	@returns: node itself if it is not shared, otherwise its copy which replaced it in the tree
+	@complexity: O(1) if node is not shared, O(log n) otherwise
+	"""
+	def own(self, node, detached=False):
+		if node.epoch == self.epoch:
+			return node
+
+		self.modcount += 1  # the node object of the position changes
+		copy = type(node)(node.key, node.value)
+		for cls in type(node).__mro__[:-1]:  # subclasses of AVLNode add their own slots
+			for name in cls.__slots__:
+				setattr(copy, name, getattr(node, name))
+		copy.epoch = self.epoch
+
+		if not detached:
+			parent = node.parent
+			if parent is not None:
+				parent = self.own(parent)
+				if parent.left is node:
+					parent.left = copy
+				else:
+					parent.right = copy
+				copy.parent = parent
+			if copy.left.is_real_node():
+				copy.left.parent = copy
+			if copy.right.is_real_node():
+				copy.right.parent = copy
+
+		if self.root is node:
+			self.root = copy
+		if self.minNode is node:
+			self.minNode = copy
+		if self.maxNode is node:
+			self.maxNode = copy
+		if self.lastNode is node:
+			self.lastNode = copy
+		return copy
+
+
+	"""returns the node that currently holds the key of a node handle
+
+	a handle returned before a snapshot may since have been replaced by a copy (see own). only nodes
+	of an older epoch can have been replaced, those are searched again by key.
+
+	@type node: AVLNode
+	@param node: a node that is, or was, in self
+	@rtype: AVLNode
+	@returns: the node in self with the same key, None if the key is no longer in self
+	@complexity: O(1) if node belongs to the current epoch, O(log n) otherwise
+	"""
+	def live_node(self, node):
+		if node.epoch == self.epoch:
+			return node
+		return self.search(node.key)[0]
+
+
+	"""makes self treat the nodes it receives from another tree as shared when that tree had snapshots.
+	the nodes have to carry the same aggregate as self's
+
+	@type donor: AVLTree
+	@param donor: the tree whose nodes are moved into self
+	@complexity: O(1)
+	"""
+	def inherit_sharing(self, donor):
+		if donor.monoid != self.monoid:
+			raise ValueError("the dictionaries keep different aggregates")
+		if donor.epoch != 0:
+			self.epoch = next(AVLTree.epochs)
+
+
+	"""takes an immutable snapshot of the dictionary
+
+	the snapshot shares all the nodes with self. later changes to self copy the nodes they modify
+	instead of modifying them (see own), so the snapshot can be read by other threads without locks
+	while self keeps changing. node handles of self must be treated as read-only once a snapshot exists.
+
+	@rtype: AVLSnapshot
+	@returns: a read-only view of the dictionary as it is now
+	@complexity: O(1)
+	"""
+	def snapshot(self):
+		self.epoch = next(AVLTree.epochs)
+		return AVLSnapshot(self)
 
 
 	"""searches for a node in the dictionary corresponding to the key (starting at the root)
@@ -110,8 +625,24 @@ class AVLTree(object):
 	@Complexity: O(log(n))
 	"""
 	def search(self, key):
+		node, e = self.search_from(self.root, key)
+		if self.counters is not None:
+			self.counters.search_paths[e] += 1
+		return node, e
+
+
+	"""searches for a node corresponding to the key in the subtree of a given node
+
+	@type node: AVLNode
+	@param node: the node to start the search from, None for an empty dictionary
+	@type key: int
+	@param key: a key to be searched
+	@rtype: (AVLNode,int)
+	@returns: a tuple (x,e) as in search
+	@complexity: O(height of node)
+	"""
+	def search_from(self, node, key):
 		e = 0
-		node = self.root
 
 		while(node and node.key != key and node.is_real_node()):
 			if(key > node.key):
@@ -127,26 +658,89 @@ class AVLTree(object):
 		return None, e
 
 
-	"""searches for a node in the dictionary corresponding to the key, starting at the max
+	"""searches for a node in the dictionary corresponding to the key, starting at a finger
         
 	@type key: int
 	@param key: a key to be searched
+	@type finger: AVLNode
+	@param finger: a node of self to start from, the default finger of the dictionary if None
 	@rtype: (AVLNode,int)
 	@returns: a tuple (x,e) where x is the node corresponding to key (or None if not found),
 	and e is the number of edges on the path between the starting node and ending node+1.
-	@complexity: O(log n)
+	@complexity: O(log d) where d is the distance between the finger and key in sorted order,
+	O(log n) worst case
 	"""
-	def finger_search(self, key):
-		curr = self.maxNode
-		edge_count = 0
-		while(curr != self.get_root() and curr.parent.key >= key):
-			curr = curr.parent
-			edge_count += 1
-		
-		tmp_tree = AVLTree()
-		tmp_tree.root = curr
-		node,search_count = tmp_tree.search(key)
+	def finger_search(self, key, finger=None):
+		if finger is None:
+			finger = self.default_finger(key)
+		if finger is None:  # empty dictionary
+			return None, 0
+		finger = self.live_node(finger)
+
+		curr, edge_count = self.climb_from_finger(finger, key)
+		node, search_count = self.search_from(curr, key)
+		if node is not None and self.fingerMode == 'last':
+			self.lastNode = node
+		if self.counters is not None:
+			self.counters.finger_climbs[edge_count] += 1
+			self.counters.search_paths[search_count + edge_count] += 1
 		return node, search_count + edge_count
+
+
+	"""returns the node finger_search and finger_insert start from when no finger is given
+
+	@type key: int
+	@param key: the key that is about to be searched or inserted
+	@rtype: AVLNode
+	@returns: the finger node, None if the dictionary is empty
+	@complexity: O(1)
+	"""
+	def default_finger(self, key):
+		mode = self.fingerMode
+		if mode == 'last' and self.lastNode is not None:
+			return self.lastNode
+		if mode == 'min':
+			return self.minNode
+		if mode == 'minmax' and self.root is not None and key < self.root.key:
+			return self.minNode
+		return self.maxNode
+
+
+	"""climbs from a finger to the lowest ancestor whose subtree may hold key
+
+	climbing over a right child link never leaves the key range of the finger's side, so the climb
+	only stops at a left child link (for larger keys) whose parent is larger than key, or the
+	symmetric right child link (for smaller keys). the max (min) node has no upper (lower) bound,
+	so it never climbs for larger (smaller) keys.
+
+	@type finger: AVLNode
+	@param finger: a real node of self
+	@type key: int
+	@param key: the key that is about to be searched or inserted
+	@rtype: (AVLNode, int)
+	@returns: a 2-tuple (curr, edge_count) where curr is the node to descend from
+	and edge_count is the number of edges climbed
+	@complexity: O(log d), O(log n) worst case
+	"""
+	def climb_from_finger(self, finger, key):
+		curr = finger
+		edge_count = 0
+
+		if key > curr.key:
+			if curr is self.maxNode:
+				return curr, 0
+			while curr.parent is not None and (curr is curr.parent.right or curr.parent.key <= key):
+				curr = curr.parent
+				edge_count += 1
+
+		elif key < curr.key:
+			if curr is self.minNode:
+				return curr, 0
+			while curr.parent is not None and (curr is curr.parent.left or curr.parent.key >= key):
+				curr = curr.parent
+				edge_count += 1
+
+		return curr, edge_count
 	
 
 	"""inserts a new node into the dictionary with corresponding key and value (starting at the root)
@@ -183,22 +777,36 @@ class AVLTree(object):
 	"""
 	def insert_call(self, key, val, start_root):
 		# create the new node and other variables
-		node = AVLNode(key, val)
-		node.left = self.ext_leaf  # left child is external leaf
-		node.right = self.ext_leaf  # right child is external leaf
-		node.height = 0  # it will be a leaf
-
-		edge_couner = 0
-		promote_counter = 0
-		parent = None
+		node = self.new_node(key, val)
 
 		# case 1: the tree is empty --> set the root to be the new node and finished
 		if start_root is None:
 			self.root = node
 			self.maxNode = node
 			self.minNode = node
-			return (node, 0, promote_counter)
+			self.modcount += 1
+			return (node, 0, 0)
 		
+		parent, edge_counter = self.search_parent(key, start_root)
+		promote_counter = self.link_leaf(node, parent)
+
+		return (node, (edge_counter + 1), promote_counter)
+
+
+	"""hangs a new leaf under the parent found for its key and rebalances
+
+	@type node: AVLNode
+	@param node: a new node from new_node
+	@type parent: AVLNode
+	@param parent: the node whose empty child slot node.key belongs in
+	@rtype: int
+	@returns: the number of PROMOTE cases during the AVL rebalancing
+	@complexity: O(log n)
+	"""
+	def link_leaf(self, node, parent):
+		key = node.key
+		promote_counter = 0
+
 		# maintain maximum pointer
 		if self.max_node() != None:
 			if key > self.maxNode.key:  # max_node is not None (because tree is not empty)
@@ -209,14 +817,16 @@ class AVLTree(object):
 			if key < self.minNode.key: # max_node is not None (because tree is not empty)
 				self.minNode = node
 
-		parent, edge_counter = self.search_parent(key, start_root)
+		parent = self.own(parent)
 		parent_num_of_children = parent.num_of_real_children()
+		self.modcount += 1
 
 		node.parent = parent
 		if key > parent.key:
 				parent.right = node
 		else:
 			parent.left = node
+		self.refresh_path(parent)
 
 		# case 2: the parent is not a leaf  -->  insert normally. Resulting tree is a valid AVL tree
 		if parent_num_of_children > 0:
@@ -228,7 +838,7 @@ class AVLTree(object):
 			promote_counter += 1
 			promote_counter += self.insert_rebalance(parent)
 
-		return (node, (edge_counter + 1), promote_counter)
+		return promote_counter
 
 
 	"""finds the parent of a given key to be inserted
@@ -257,6 +867,110 @@ class AVLTree(object):
 		
 		return y,(edge_count - 1)
 
+
+	"""finds the node of a key, or the parent it would be inserted under, in one descent
+
+	same walk as search_parent, stopping early when the key is found
+
+	@type key: int
+	@param key: the key to look for
+	@rtype: (AVLNode, AVLNode)
+	@returns: a 2-tuple (x, y) where x is the node of key (None if absent) and y is the parent
+	for a new node with key when x is None (None if the dictionary is empty)
+	@complexity: O(log n)
+	"""
+	def search_or_parent(self, key):
+		y = None
+		x = self.root
+
+		while x is not None and x.is_real_node():
+			if key == x.key:
+				return x, None
+			y = x
+			if key < x.key:
+				x = x.left
+			else:
+				x = x.right
+
+		return None, y
+
+
+	"""creates the node of a key below the parent found by search_or_parent
+
+	@rtype: AVLNode
+	@returns: the new node
+	@complexity: O(log n)
+	"""
+	def insert_below(self, parent, key, val):
+		if parent is None:
+			node, _, _ = self.insert(key, val)
+			return node
+
+		node = self.new_node(key, val)
+		self.link_leaf(node, parent)
+		self.treeSize += 1
+		return node
+
+
+	"""inserts a key, or replaces its value if it is already in the dictionary, with a single descent
+
+	@type key: int
+	@param key: key of the item
+	@type val: string
+	@param val: the new value of the item
+	@rtype: (AVLNode, bool)
+	@returns: a 2-tuple (x, inserted) where x is the node of key and inserted is True if it is new
+	@complexity: O(log n), rebalancing only when a node is created
+	"""
+	def upsert(self, key, val):
+		node, parent = self.search_or_parent(key)
+		if node is not None:
+			node = self.own(node)
+			node.value = val
+			if self.monoid is not None:
+				self.refresh_path(node)
+			return node, False
+		return self.insert_below(parent, key, val), True
+
+
+	"""returns the node of a key, inserting it with the value factory() if it is missing
+
+	@type key: int
+	@param key: key of the item
+	@type factory: function
+	@param factory: called without arguments for the value of a new key only
+	@rtype: AVLNode
+	@returns: the node of key
+	@complexity: O(log n), rebalancing only when a node is created
+	"""
+	def get_or_insert(self, key, factory):
+		node, parent = self.search_or_parent(key)
+		if node is not None:
+			return node
+		return self.insert_below(parent, key, factory())
+
+
+	"""replaces the value of a key by fn applied to it, with a single descent
+
+	@type key: int
+	@param key: key of the item
+	@type fn: function
+	@param fn: fn(value) returns the new value
+	@param default: the value fn is applied to when key is missing, the result is inserted
+	@rtype: AVLNode
+	@returns: the node of key
+	@complexity: O(log n), rebalancing only when a node is created
+	"""
+	def update(self, key, fn, default=None):
+		node, parent = self.search_or_parent(key)
+		if node is not None:
+			node = self.own(node)
+			node.value = fn(node.value)
+			if self.monoid is not None:
+				self.refresh_path(node)
+			return node
+		return self.insert_below(parent, key, fn(default))
+
 	""" perform rebalance after insertion i.e promotions and rotations
 
 	@param node: the node to start rebalance from
@@ -286,15 +1000,21 @@ class AVLTree(object):
 				# case 2.1.1: child is (1,2)
 				if x_bf == 12:
 					self.right_rotation(curr)
+					if self.counters is not None:
+						self.counters.rotations['single_right'] += 1
 					
 				# case 2.1.2: child is (2,1)
 				elif x_bf == 21:
 					self.left_rotation(x)
 					self.right_rotation(curr)
+					if self.counters is not None:
+						self.counters.rotations['double_left_right'] += 1
 
 				#case 2.1.3: child is (1,1)
 				elif x_bf == 11:
 					self.right_rotation(curr)
+					if self.counters is not None:
+						self.counters.rotations['single_right'] += 1
 				
 			
 			# case 2.2: (2,0) junction *SYMETRIC TO CASE 2.1*
@@ -306,229 +1026,350 @@ class AVLTree(object):
 				if x_bf == 12:
 					self.right_rotation(x)
 					self.left_rotation(curr)
+					if self.counters is not None:
+						self.counters.rotations['double_right_left'] += 1
 				
 				# case 2.2.2: child is (2,1)  *SYMETRIC TO CASE 2.1.1*
 				elif x_bf == 21:
 					self.left_rotation(curr)
+					if self.counters is not None:
+						self.counters.rotations['single_left'] += 1
 				
 				# case 2.2.3: child is (1,1) *SYMMETRIC TO CASE 2.1.3*
 				elif x_bf == 11:
 					self.left_rotation(curr)
+					if self.counters is not None:
+						self.counters.rotations['single_left'] += 1
 			
 			curr = curr.parent 
 		
 		return promote_counter
 
 
-	"""inserts a new node into the dictionary with corresponding key and value, starting at the max
+	"""inserts a new node into the dictionary with corresponding key and value, starting at a finger
 
 	@type key: int
 	@pre: key currently does not appear in the dictionary
 	@param key: key of item that is to be inserted to self
 	@type val: string
 	@param val: the value of the item
+	@type finger: AVLNode
+	@param finger: a node of self to start from, the default finger of the dictionary if None
 	@rtype: (AVLNode,int,int)
 	@returns: a 3-tuple (x,e,h) where x is the new node,
 	e is the number of edges on the path between the starting node and new node before rebalancing,
 	and h is the number of PROMOTE cases during the AVL rebalancing
-	@complexity: O(log n)
+	@complexity: O(log d) search where d is the distance between the finger and key in sorted order,
+	O(log n) worst case
 	"""
-	def finger_insert(self, key, val):
+	def finger_insert(self, key, val, finger=None):
 		# Edge case: if tree is empty --> execute normal insert
 		if self.root == None:
-			return self.insert(key,val)
+			x, e, h = self.insert(key,val)
+		else:
+			if finger is None:
+				finger = self.default_finger(key)
+			finger = self.live_node(finger)
 
-		# find the key to start the insert from
-		curr = self.max_node()
-		edge_count = 0
-		while(curr != self.root and curr.parent.key >= key):
-			curr = curr.parent
-			edge_count += 1
+			# find the key to start the insert from
+			curr, edge_count = self.climb_from_finger(finger, key)
+			if self.counters is not None:
+				self.counters.finger_climbs[edge_count] += 1
 
-		#insert the new node
-		x,e,h = self.insert_call(key,val,curr)
-		self.treeSize += 1
-		return x,(e+edge_count),h
+			#insert the new node
+			x,e,h = self.insert_call(key,val,curr)
+			self.treeSize += 1
+			e += edge_count
+
+		if self.fingerMode == 'last':
+			self.lastNode = x
+		return x,e,h
 
 
 	"""deletes node from the dictionary
 
+	the node is unlinked (or replaced by its successor) in place, then a single upward pass
+	rebalances and fixes the subtree sizes. the min and max pointers move in O(1) - the maximal
+	node has no right child, so its predecessor is its left child (a leaf) or its parent.
+
 	@type node: AVLNode
 	@pre: node is a real pointer to a node in self
 	@complexity: O(log n)
 	"""
-	def delete(self, node, innercall = False):
+	def delete(self, node):
+		# a handle taken before a snapshot may have been copied since
+		node = self.own(self.live_node(node))
+		self.treeSize -= 1
+
+		if node is self.lastNode:
+			self.lastNode = None
+		if node is self.maxNode:
+			self.maxNode = node.left if node.left.is_real_node() else node.parent
+		if node is self.minNode:
+			self.minNode = node.right if node.right.is_real_node() else node.parent
 
-		if not innercall:
-			self.treeSize -= 1  
+		parent = node.parent
+		if node.left.is_real_node() and node.right.is_real_node():
+			# the successor is the minimum of the right subtree, it has no left child
+			succ = node.right
+			while succ.left.is_real_node():
+				succ = succ.left
+			succ = self.own(succ)
+
+			if succ is node.right:
+				start = succ
+			else:
+				start = succ.parent
+				self.replace_child(start, succ, succ.right)
+				succ.right = node.right
+				succ.right.parent = succ
 
-			# maintain pointer to max node
-			if node == self.max_node():
-				self.maxNode = self.find_predecessor(node)
+			succ.left = node.left
+			succ.left.parent = succ
+			succ.height = node.height
+			self.replace_child(parent, node, succ)
 
-			# maintain pointer to min node
-			if node == self.minNode:
-				self.minNode = self.find_successor(node)
+		else:
+			child = node.left if node.left.is_real_node() else node.right
+			self.replace_child(parent, node, child)
+			start = parent
 
-		parent = node.parent
+		iterations = self.delete_rebalance(start)
+		if self.counters is not None:
+			self.counters.delete_rebalance_loops[iterations] += 1
+		if self.pool is not None:
+			self.recycle(node)
 
-		# edge case - tree is only one node
-		if node == self.root and node.height == 0:  
-			self.root = None
-			self.maxNode = None
-			self.minNode = None
-			self.treeSize = 0
-			return
-		
-		
 
-		children_count = node.num_of_real_children()
-		
-		if children_count == 2:
-			suc_node = self.find_successor(node)
-			self.delete(suc_node, innercall = True)
+	"""deletes the node of a key if the key is in the dictionary
 
-			suc_node.height = node.height
+	@type key: int
+	@param key: the key to delete
+	@rtype: AVLNode
+	@returns: the deleted node, None if key is not in the dictionary. while enable_pool is on the
+	node is reused, so the deleted (key, value) item is returned instead
+	@complexity: O(log n)
+	"""
+	def delete_key(self, key):
+		node, _ = self.search(key)
+		if node is None:
+			return None
+		if self.pool is not None:
+			item = (node.key, node.value)
+			self.delete(node)
+			return item
+		self.delete(node)
+		return node
 
-			# set child - parent relationship
-			parent = node.parent
 
-			suc_node.left = node.left
-			suc_node.right = node.right
-			suc_node.parent = parent
-			#assign the suc_node to be it's child parent as well
-			suc_node.left.parent = suc_node
-			suc_node.right.parent = suc_node
+	"""deletes the node with the minimal key
 
-			
+	the minimal node has no left child, so it is replaced by its right child (a leaf, which becomes
+	the new minimum) or the min pointer moves to its parent, without any search.
 
-			dir = self.node_parent_direction(node)
-			if dir == 'R':
-				parent.right = suc_node
-			if dir == 'L':
-				parent.left = suc_node
-			if dir == 'N':
-				self.root = suc_node
+	@rtype: AVLNode
+	@returns: the deleted node, None if the dictionary is empty. the (key, value) item while
+	enable_pool is on
+	@complexity: O(log n) to refresh the sizes, the rebalancing is O(1) amortized
+	"""
+	def pop_min(self):
+		if self.minNode is None:
+			return None
+		node = self.own(self.minNode)
+		return self.pop_extreme(node, node.right)
 
 
-		elif children_count == 1:
-			self.delete_one_child(node)
+	"""deletes the node with the maximal key
 
-		elif children_count == 0:
-			self.delete_zero_child(node)
+	@rtype: AVLNode
+	@returns: the deleted node, None if the dictionary is empty. the (key, value) item while
+	enable_pool is on
+	@complexity: O(log n) to refresh the sizes, the rebalancing is O(1) amortized
+	"""
+	def pop_max(self):
+		if self.maxNode is None:
+			return None
+		node = self.own(self.maxNode)
+		return self.pop_extreme(node, node.left)
 
-		# reblance function
-		self.delete_rebalance(parent)
-	
 
-		"""perfomes the deleteion of a node with zero children (leaf)
+	"""unlinks the minimal or maximal node, which has at most the one child given
 
-		@param node: the node to be deleted from self
-		@type node: AVLNode
-		@complexity: O(1)
-		"""
-	def delete_zero_child(self,node):
+	@type node: AVLNode
+	@param node: the minimal or maximal node, owned by self
+	@type child: AVLNode
+	@param child: its only possible child - the right one for the min, the left one for the max
+	@rtype: AVLNode
+	@returns: node, or its (key, value) item if node went to the pool
+	@complexity: O(log n)
+	"""
+	def pop_extreme(self, node, child):
 		parent = node.parent
-		parent_bf = parent.balance_factor()
-		dir = self.node_parent_direction(node)
+		self.treeSize -= 1
+		if node is self.lastNode:
+			self.lastNode = None
+
+		replacement = child if child.is_real_node() else parent
+		if node is self.minNode:
+			self.minNode = replacement
+		if node is self.maxNode:
+			self.maxNode = replacement
+
+		self.replace_child(parent, node, child)
+		iterations = self.delete_rebalance(parent)
+		if self.counters is not None:
+			self.counters.delete_rebalance_loops[iterations] += 1
+		if self.pool is not None:
+			item = (node.key, node.value)
+			self.recycle(node)
+			return item
+		return node
 
-		# delete the node
-		if dir == 'L':
-			parent.left = self.ext_leaf
-		elif dir == 'R':
-			parent.right = self.ext_leaf
-
-		#further handeling if needed
-		if parent_bf != 0:
-
-			if dir == 'L':
-				# parent is (1,2)
-				if parent_bf == -1:
-					self.demote(node.parent)
-
-				# parent is (2,1)
-				elif parent_bf == 1:
-					pass
-
-			elif dir == 'R':
-				# parent is (1,2)
-				if parent_bf == -1:
-					pass
-
-				# parent is (2,1)
-				elif parent_bf == 1:
-					self.demote(parent)
-
-		"""perfomes the deleteion of a node with one child
-
-		@param node: the node to be deleted from self
-		@type node: AVLNode
-		@complexity: O(1)
-		"""
-	def delete_one_child(self,node):
-		# edge case - root is the node (and has only one child which is definitely a leaf)
-		# in this case the child will be the new root
-		if node == self.root:
-			if node.left.is_real_node():
-				self.root = node.left
-			else:
-				self.root = node.right
-			return
-		
-		parent = node.parent
-		parent_bf = parent.balance_factor()
-		if node.left.is_real_leaf():
-			child = node.left
-		else:
-			child = node.right
 
-		dir = self.node_parent_direction(node)
+	"""adds an item to the dictionary used as a priority queue, climbing from the min or the max node
 
-		# bypass the node
-		if dir == 'L':
-			parent.left = child
-			child.parent = parent
-		elif dir == 'R':
-			parent.right = child
-			child.parent = parent
+	@type key: int
+	@pre: key currently does not appear in the dictionary (use (priority, sequence) tuples as keys
+	to queue equal priorities)
+	@param key: the priority of the item
+	@param val: the value of the item
+	@rtype: AVLNode
+	@returns: the new node
+	@complexity: O(log d) where d is the distance of key from the nearer end, O(log n) worst case
+	"""
+	def push(self, key, val):
+		if self.root is None:
+			node, _, _ = self.insert(key, val)
+			return node
 
-		if dir == 'L':
-			# parent is (1,2)
-			if parent_bf == -1:
-				self.demote(parent)
+		finger = self.minNode if key < self.root.key else self.maxNode
+		node, _, _ = self.finger_insert(key, val, finger)
+		return node
 
-			# parent is (2,1)
-			elif parent_bf == 1:
-				pass
 
-		elif dir == 'R':
-			# parent is (1,2)
-			if parent_bf == -1:
-				pass
+	"""returns the node with the minimal key without removing it
 
-			#parent is (2,1)
-			elif parent_bf == 1:
-				self.demote(parent)
+	@rtype: AVLNode
+	@returns: the minimal node, None if the dictionary is empty
+	@complexity: O(1)
+	"""
+	def peek_min(self):
+		return self.minNode
 
 
-	"""handle rebalance after deleteion of a node from self
-	
+	"""returns the node with the maximal key without removing it
+
+	@rtype: AVLNode
+	@returns: the maximal node, None if the dictionary is empty
+	@complexity: O(1)
+	"""
+	def peek_max(self):
+		return self.maxNode
+
+
+	"""removes the k smallest items at once, with one split instead of k deletions
+
+	@type k: int
+	@param k: the number of items to remove, all of them if k >= size
+	@rtype: AVLTree
+	@returns: a dictionary holding the removed items
+	@complexity: O(log n)
+	"""
+	def pop_min_many(self, k):
+		drained = type(self)(aggregate=self.monoid)
+		drained.inherit_sharing(self)
+		if k <= 0 or self.root is None:
+			return drained
+		if k >= self.treeSize:
+			drained.set_root(self.root)
+			self.set_root(None)
+			return drained
+
+		# keys < pivot | pivot | keys > pivot, where exactly k keys are smaller than the pivot
+		pivot = self.select(k)
+		before, mid, after = self.split_nodes(self.root, pivot.key)
+		after, _ = self.join_nodes(self.ext_leaf, mid, after)
+		drained.set_root(before)
+		self.set_root(after)
+		return drained
+
+
+	"""lowers the key of a node
+
+	if the new key still sorts after the predecessor the node keeps its place and only its key
+	changes, otherwise the item is deleted and reinserted.
+
+	@type node: AVLNode
+	@param node: a node of self
+	@type new_key: int
+	@pre: new_key is smaller than node.key and does not appear in the dictionary
+	@param new_key: the new key
+	@rtype: AVLNode
+	@returns: the node that holds new_key
+	@complexity: O(log n), without any rebalancing if the order does not change
+	"""
+	def decrease_key(self, node, new_key):
+		node = self.live_node(node)
+		if not new_key < node.key:
+			raise ValueError("new key %r is not smaller than %r" % (new_key, node.key))
+
+		if node is not self.minNode:
+			pred = self.find_predecessor(node)
+			if not pred.key < new_key:
+				self.delete(node)
+				return self.push(new_key, node.value)
+
+		node = self.own(node)
+		node.key = new_key
+		self.modcount += 1  # cursors on node have to pick up its new key
+		return node
+
+
+	"""puts new in the place of old under parent
+
+	@type parent: AVLNode
+	@param parent: the parent of old, None if old is the root
+	@type old: AVLNode
+	@param old: a child of parent
+	@type new: AVLNode
+	@param new: the replacement, may be the external leaf
+	@complexity: O(1)
+	"""
+	def replace_child(self, parent, old, new):
+		self.modcount += 1
+		if new.is_real_node():
+			new.parent = parent
+
+		if parent is None:
+			self.root = new if new.is_real_node() else None
+		elif parent.left is old:
+			parent.left = new
+		else:
+			parent.right = new
+
+
+	"""rebalances and refreshes the sizes after a deletion, walking up from the lowest changed node
+
+	the walk demotes (2,2) nodes and rotates (3,1) and (1,3) nodes until a subtree keeps its
+	height, then only refreshes the sizes up to the root.
+
 	@type node: AVLNode
-	@pararm node: the node we start rebalancing from 
+	@pararm node: the node we start rebalancing from, None if the dictionary became empty
+	@rtype: int
+	@returns: the number of iterations of the rebalancing loop
 	@complexity: O(log n)
 	"""
-	def delete_rebalance(self,node):
-		good_node_count = 0 
+	def delete_rebalance(self, node):
+		iterations = 0
 		curr = node
 
-		while (curr) and (good_node_count < 2):
+		while curr is not None:
+			iterations += 1
+			self.refresh(curr)
 			curr_bf = curr.balance_factor_detailed()
-			# initial check if rebalancing is needed
-			if curr_bf in [11,12,21]:
-				good_node_count += 1
-			
-			# (2,2)
-			elif curr_bf == 22:
+
+			# (2,2) - the height drops, continue at the parent
+			if curr_bf == 22:
 				self.demote(curr)
 
 			# (3,1)
@@ -536,45 +1377,52 @@ class AVLTree(object):
 				right_node = curr.right
 				right_node_bf = right_node.balance_factor_detailed()
 
-				# (1,1)
-				if right_node_bf == 11:
-					self.left_rotation(curr)
-					good_node_count = 0
-
-				# (2,1)
-				elif right_node_bf == 21:
+				# (1,2) - double rotation
+				if right_node_bf == 12:
+					self.right_rotation(right_node)
 					self.left_rotation(curr)
-					good_node_count = 0
+					kind = 'double_right_left'
 
-				# (1,2)
-				elif right_node_bf == 12:
-					self.right_rotation(right_node)
+				# (1,1) or (2,1) - single rotation
+				else:
 					self.left_rotation(curr)
-					good_node_count = 0
+					kind = 'single_left'
 
+				if self.counters is not None:
+					self.counters.rotations[kind] += 1
+				curr = curr.parent  # the new root of the subtree
+				if right_node_bf == 11:  # the subtree kept its height
+					break
 
-			# (1,3)
+			# (1,3) *SYMMETRIC TO (3,1)*
 			elif curr_bf == 13:
 				left_node = curr.left
 				left_node_bf = left_node.balance_factor_detailed()
 
-				# (1,1)
-				if left_node_bf == 11:
-					self.right_rotation(curr)
-					good_node_count = 0
-				
-				# (2,1)
-				elif left_node_bf == 21:
+				if left_node_bf == 21:
 					self.left_rotation(left_node)
 					self.right_rotation(curr)
-					good_node_count = 0
-
-				elif left_node_bf == 12:
+					kind = 'double_left_right'
+				else:
 					self.right_rotation(curr)
-					good_node_count = 0
+					kind = 'single_right'
+
+				if self.counters is not None:
+					self.counters.rotations[kind] += 1
+				curr = curr.parent
+				if left_node_bf == 11:
+					break
+
+			# (1,1), (1,2) or (2,1) - the height did not change
+			else:
+				break
 
 			curr = curr.parent
 
+		if curr is not None:
+			self.refresh_path(curr.parent)
+		return iterations
+
 
 	"""demote a nodes height by 1
 	
@@ -584,6 +1432,8 @@ class AVLTree(object):
 	"""
 	def demote(self,node):
 		node.height -= 1
+		if self.counters is not None:
+			self.counters.demotions += 1
 
 
 	"""promote a node height by 1
@@ -594,6 +1444,8 @@ class AVLTree(object):
 	"""
 	def promote(self,node):
 		node.height += 1
+		if self.counters is not None:
+			self.counters.promotions += 1
 
 
 	"""returns if the current node is a Left or Right Child of its parent
@@ -614,7 +1466,7 @@ class AVLTree(object):
 	"""joins self with item and another AVLTree
 
 	@type tree2: AVLTree 
-	@param tree2: a dictionary to be joined with self
+	@param tree2: a dictionary to be joined with self, it is left empty
 	@type key: int 
 	@param key: the key separting self and tree2
 	@type val: string
@@ -624,98 +1476,113 @@ class AVLTree(object):
 	@Complexity: O(log(n))
 	"""
 	def join(self, tree2, key, val):
-		new_root = AVLNode(key, val)
+		self.inherit_sharing(tree2)
+		new_root = self.new_node(key, val)
 
-		if(self.root == None and tree2.root == None):
-			_, _, _ = self.insert(key, val)
-			return
-
-		elif(self.root == None):
-			self.root = tree2.root
-			self.maxNode = tree2.max_node()
-			self.minNode = tree2.min_node()
-			self.treeSize = tree2.treeSize
+		root1 = self.root if self.root is not None else self.ext_leaf
+		root2 = tree2.root if tree2.root is not None else self.ext_leaf
 
-			self.insert(new_root.key, new_root.value)
-			return
-		
-		elif(tree2.root == None):
-			self.insert(new_root.key, new_root.value)
-			return
-
-		if(self.root.key >= tree2.root.key): #check which tree has larger values
-			right_tree = self
-			left_tree = tree2
+		#check which tree has larger values
+		if (root1.is_real_node() and root1.key < key) or (root2.is_real_node() and root2.key > key):
+			left, right = root1, root2
 		else:
-			right_tree = tree2
-			left_tree = self
-
-		min = left_tree.minNode
-		max = right_tree.maxNode
+			left, right = root2, root1
 
-		if(right_tree.root.height >= left_tree.root.height): #case2: right tree is taller than left tree
-			#find node of similar height to other tree
-			node = right_tree.root
-			parent = node.parent
-			while(node.is_real_node() and node.height > left_tree.root.height):
-				parent = node
-				node = node.left
-				
-			#join
-			new_root.left = left_tree.root
-			left_tree.root.parent = new_root
+		tree2.set_root(None)
+		root, _ = self.join_nodes(left, new_root, right)
+		self.set_root(root)
 
-			new_root.right = node
-			node.parent = new_root
-
-			if(parent == None):
-				right_tree.root = new_root
-			else:
-				parent.left = new_root
-				new_root.parent = parent
+		return
 
-			#balance tree
-			new_root.height = left_tree.root.height + 1
-			p = right_tree.insert_rebalance(new_root)
+	"""joins self with another AVLTree without a separating key
 
-			#new tree root
-			self.root = right_tree.root
+	@type tree2: AVLTree
+	@param tree2: a dictionary to be joined with self, it is left empty
+	@pre: all keys in self are smaller than all keys in tree2, or the opposite way
+	@complexity: O(log n)
+	"""
+	def join2(self, tree2):
+		self.inherit_sharing(tree2)
+		if tree2.root is None:
+			return
+		if self.root is None or self.maxNode.key < tree2.minNode.key:
+			left, right = self.root, tree2.root
+		else:
+			left, right = tree2.root, self.root
 
-		else: #case3: left tree is taller than right tree
-			#find node of similar height to other tree
-			node = left_tree.root
-			parent = node.parent
-			while(node.is_real_node() and node.height > right_tree.root.height):
-				parent = node
-				node = node.right
+		tree2.set_root(None)
+		root, _ = self.join2_nodes(left if left is not None else self.ext_leaf, right)
+		self.set_root(root)
 
 
-			#join
-			parent.right = new_root
-			new_root.parent = parent
+	"""concatenates many dictionaries whose key ranges follow each other
 
-			new_root.right = right_tree.root
-			right_tree.root.parent = new_root
+	the pair of neighbours holding the lowest tree is always joined first, so the small trees are
+	merged with each other before they meet the large ones.
 
-			new_root.left = node
-			node.parent = new_root
+	@type trees: list
+	@param trees: AVLTrees in increasing key order, every one of them is left empty
+	@pre: every key of trees[i] is smaller than every key of trees[i+1]
+	@rtype: AVLTree
+	@returns: a dictionary holding all the items. ValueError is raised before any tree is emptied if
+	the key ranges overlap or the trees keep different aggregates
+	@complexity: O(k log k + sum of log n_i) for k trees of sizes n_i
+	"""
+	@classmethod
+	def concat_many(cls, trees):
+		result = cls(aggregate=trees[0].monoid if trees else None)
+		# check everything before the first tree is emptied
+		for tree in trees:
+			if tree.monoid != result.monoid:
+				raise ValueError("the dictionaries keep different aggregates")
+		trees = [tree for tree in trees if tree.root is not None]
+		for tree, following in zip(trees, trees[1:]):
+			if not tree.maxNode.key < following.minNode.key:
+				raise ValueError("the trees must be in increasing key order and disjoint")
+
+		roots = []
+		for tree in trees:
+			result.inherit_sharing(tree)
+			roots.append(tree.root)
+			tree.set_root(None)
+		if not roots:
+			return result
+
+		# a doubly linked list of the roots not merged yet, and a heap of (height, index) with lazy deletion
+		k = len(roots)
+		prev_of = list(range(-1, k - 1))
+		next_of = list(range(1, k + 1))
+		heap = sorted((root.height, i) for i, root in enumerate(roots))
+		alive = k
+
+		while alive > 1:
+			height, i = heappop(heap)
+			if roots[i] is None or roots[i].height != height:
+				continue
+
+			# merge with the lower neighbour, the left one of the pair keeps the joined root
+			left, right = prev_of[i], next_of[i]
+			if right == k or (left >= 0 and roots[left].height < roots[right].height):
+				i, j = left, i
+			else:
+				j = right
 
-			#balance tree
-			new_root.height = right_tree.root.height + 1
-			p = self.insert_rebalance(new_root.parent)
+			roots[i], _ = result.join2_nodes(roots[i], roots[j])
+			roots[j] = None
+			next_of[i] = next_of[j]
+			if next_of[j] < k:
+				prev_of[next_of[j]] = i
+			heappush(heap, (roots[i].height, i))
+			alive -= 1
 
-			#new tree root
-			self.root = left_tree.root
+		result.set_root(roots[0])
+		return result
 
-		#new tree variables
-		self.treeSize = right_tree.treeSize + left_tree.treeSize + 1
-		self.minNode = min
-		self.maxNode = max
 
-		return
-		
 	"""splits the dictionary at a given node
 
+	works on the subtrees directly with split_nodes, the dictionary is left empty.
+
 	@type node: AVLNode
 	@pre: node is in self
 	@param node: the node in the dictionary to be used for the split
@@ -726,56 +1593,566 @@ class AVLTree(object):
 	@Complexity: O(log(n))
 	"""
 	def split(self, node):
-		#get relevant things from original tree
-		split_key = node.key
-		left_min = self.minNode
-		right_max = self.maxNode
-
-		#build split trees
-		left_tree = AVLTree()
-		right_tree = AVLTree()
-
-		if(node.left.is_real_node()):
-			left_tree.root = node.left
-			left_tree.root.parent = None
-		if(node.right.is_real_node()):
-			right_tree.root = node.right
-			right_tree.root.parent = None
-
-		node = node.parent
-
-		#traverse path from split node to root and split tree
-		while(node != None):
-			left_sub = AVLTree()
-			right_sub = AVLTree()
-
-			if(node.key < split_key):
-				left_sub.root = node.left
-				left_sub.root.parent = None
-
-				left_tree.join(left_sub, node.key, node.value)
-			
-			else:
-				right_sub.root = node.right
-				right_sub.root.parent = None
+		node = self.live_node(node)
+		left, _, right = self.split_nodes(self.root, node.key)
+		return self.split_trees(left, right)
 
-				right_tree.join(right_sub, node.key, node.value)
 
-			node = node.parent
+	"""splits the dictionary at a key that does not have to appear in it, leaving it empty
 
-		#update min and max for new trees:
-		if(left_tree.root != None):
-			left_tree.minNode = left_min
-			left_tree.maxNode = left_tree.find_max()
-			
-		
-		if(right_tree.root != None):
-			right_tree.minNode = right_tree.find_min()
-			right_tree.maxNode = right_max
+	@type key: int
+	@param key: the split key
+	@rtype: (AVLTree, AVLTree)
+	@returns: a tuple (left, right), where left holds the keys smaller than key and right holds
+	the keys that are at least key
+	@complexity: O(log n)
+	"""
+	def split_key(self, key):
+		root = self.root if self.root is not None else self.ext_leaf
+		left, mid, right = self.split_nodes(root, key)
+		if mid is not None:
+			right, _ = self.join_nodes(self.ext_leaf, mid, right)
+		return self.split_trees(left, right)
 
+
+	"""wraps the two subtrees of a split in new dictionaries and empties self
+
+	@type left: AVLNode
+	@param left: the detached root of the smaller keys (may be virtual)
+	@type right: AVLNode
+	@param right: the detached root of the larger keys (may be virtual)
+	@rtype: (AVLTree, AVLTree)
+	@complexity: O(log n) to find the min and max nodes of both
+	"""
+	def split_trees(self, left, right):
+		left_tree = type(self)(finger=self.fingerMode, aggregate=self.monoid)
+		right_tree = type(self)(finger=self.fingerMode, aggregate=self.monoid)
+		left_tree.inherit_sharing(self)
+		right_tree.inherit_sharing(self)
+		left_tree.set_root(left)
+		right_tree.set_root(right)
+		self.set_root(None)
 		return left_tree, right_tree
 
 
+	"""detaches the two subtrees of a node from it
+
+	only the parent pointers of the children are cleared, node keeps its (now stale) child pointers
+	until it is linked again (e.g. by join_nodes), so exposing never copies a shared node.
+
+	@type node: AVLNode
+	@param node: a real node, its own parent pointer is left untouched
+	@rtype: (AVLNode, AVLNode)
+	@returns: the roots (possibly virtual) of the left and right subtrees, now without a parent
+	@complexity: O(1)
+	"""
+	def expose(self, node):
+		left = node.left
+		right = node.right
+		if left.is_real_node():
+			left.parent = None
+		if right.is_real_node():
+			right.parent = None
+		return left, right
+
+
+	"""joins two detached subtrees using a detached separator node, working directly on the nodes
+
+	@type left: AVLNode
+	@param left: root of a subtree whose keys are all smaller than mid.key (may be virtual)
+	@type mid: AVLNode
+	@param mid: the separator node, it becomes part of the result
+	@type right: AVLNode
+	@param right: root of a subtree whose keys are all larger than mid.key (may be virtual)
+	@rtype: (AVLNode, int)
+	@returns: a 2-tuple (root, h) where root is the root of the joined subtree (its parent is None)
+	and h is the number of PROMOTE cases during the rebalancing
+	@complexity: O(|left.height - right.height| + 1)
+	"""
+	def join_nodes(self, left, mid, right):
+		mid = self.own(mid, detached=True)
+		mid.parent = None
+
+		# case 1: heights are close enough - mid becomes the root
+		if abs(left.height - right.height) <= 1:
+			mid.left = left
+			mid.right = right
+			if left.is_real_node():
+				left.parent = mid
+			if right.is_real_node():
+				right.parent = mid
+			mid.height = max(left.height, right.height) + 1
+			self.refresh(mid)
+			return mid, 0
+
+		# case 2: left is taller - hang mid on the right spine of left
+		if left.height > right.height:
+			node = left
+			while node.height > right.height + 1:
+				parent = node
+				node = node.right
+			parent = self.own(parent)
+			node = parent.right
+
+			mid.left = node
+			mid.right = right
+			parent.right = mid
+
+		# case 3: right is taller - hang mid on the left spine of right *SYMMETRIC TO CASE 2*
+		else:
+			node = right
+			while node.height > left.height + 1:
+				parent = node
+				node = node.left
+			parent = self.own(parent)
+			node = parent.left
+
+			mid.left = left
+			mid.right = node
+			parent.left = mid
+
+		mid.parent = parent
+		if mid.left.is_real_node():
+			mid.left.parent = mid
+		if mid.right.is_real_node():
+			mid.right.parent = mid
+		mid.height = max(mid.left.height, mid.right.height) + 1
+
+		self.refresh_path(mid)
+		promote_counter = self.join_rebalance(parent)
+
+		root = mid
+		while root.parent is not None:
+			root = root.parent
+		return root, promote_counter
+
+
+	"""rebalance after a subtree below node grew, stops at the first node whose height is unchanged
+
+	unlike insert_rebalance this also handles the single rotation with a (1,1) child, after
+	which the rotated subtree is one level taller and its parent still has to be checked.
+
+	@type node: AVLNode
+	@param node: the parent of the subtree that grew
+	@rtype: int
+	@returns: the number of PROMOTE cases
+	@complexity: O(log n) worst case
+	"""
+	def join_rebalance(self, node):
+		promote_counter = 0
+		curr = node
+
+		while curr is not None:
+			curr_bf = curr.balance_factor_detailed()
+
+			# case 1: (0,1) junction
+			if curr_bf in [1,10]:
+				self.promote(curr)
+				promote_counter += 1
+				curr = curr.parent
+
+			# case 2.1: (0,2) junction
+			elif curr_bf == 2:
+				x = curr.left
+				if x.balance_factor_detailed() == 21:
+					self.left_rotation(x)
+					kind = 'double_left_right'
+				else:
+					kind = 'single_right'
+				self.right_rotation(curr)
+				if self.counters is not None:
+					self.counters.rotations[kind] += 1
+				curr = curr.parent.parent  # curr went down, skip the new subtree root
+
+			# case 2.2: (2,0) junction *SYMETRIC TO CASE 2.1*
+			elif curr_bf == 20:
+				x = curr.right
+				if x.balance_factor_detailed() == 12:
+					self.right_rotation(x)
+					kind = 'double_right_left'
+				else:
+					kind = 'single_left'
+				self.left_rotation(curr)
+				if self.counters is not None:
+					self.counters.rotations[kind] += 1
+				curr = curr.parent.parent
+
+			# stop condition - the height of curr did not change
+			else:
+				break
+
+		return promote_counter
+
+
+	"""joins two detached subtrees without a separator
+
+	@type left: AVLNode
+	@param left: root of a subtree whose keys are all smaller than the keys of right (may be virtual)
+	@type right: AVLNode
+	@param right: root of a subtree (may be virtual)
+	@rtype: (AVLNode, int)
+	@returns: a 2-tuple (root, h) as in join_nodes
+	@complexity: O(log n)
+	"""
+	def join2_nodes(self, left, right):
+		if not right.is_real_node():
+			return left, 0
+		if not left.is_real_node():
+			return right, 0
+
+		rest, first = self.split_first_node(right)
+		return self.join_nodes(left, first, rest)
+
+
+	"""removes the minimal node of a detached subtree
+
+	@type root: AVLNode
+	@param root: a real subtree root without a parent
+	@rtype: (AVLNode, AVLNode)
+	@returns: a 2-tuple (rest, first) where first is the detached minimal node
+	and rest is the root of the remaining subtree
+	@complexity: O(log n)
+	"""
+	def split_first_node(self, root):
+		left, right = self.expose(root)
+		if not left.is_real_node():
+			return right, root
+
+		rest, first = self.split_first_node(left)
+		rest, _ = self.join_nodes(rest, root, right)
+		return rest, first
+
+
+	"""splits a detached subtree by a key, working directly on the nodes
+
+	@type node: AVLNode
+	@param node: root of a detached subtree (may be virtual)
+	@type key: int
+	@param key: the split key, it does not have to appear in the subtree
+	@rtype: (AVLNode, AVLNode, AVLNode)
+	@returns: a 3-tuple (left, mid, right) where left and right are the roots of the subtrees holding
+	the keys smaller and larger than key, and mid is the detached node holding key (None if absent)
+	@complexity: O(log n)
+	"""
+	def split_nodes(self, node, key):
+		if not node.is_real_node():
+			return node, None, node
+
+		left, right = self.expose(node)
+		if key == node.key:
+			return left, node, right
+
+		if key < node.key:
+			left, mid, rest = self.split_nodes(left, key)
+			right, _ = self.join_nodes(rest, node, right)
+		else:
+			rest, mid, right = self.split_nodes(right, key)
+			left, _ = self.join_nodes(left, node, rest)
+		return left, mid, right
+
+
+	"""inserts a batch of items, rebalancing once per batch instead of once per key
+
+	small batches are merged in divide and conquer over the tree: the root's key splits the batch,
+	both halves are merged into the root's subtrees and the results are joined back with join_nodes.
+	batches that are large relative to the tree are merged with the in-order node sequence and
+	the tree is rebuilt with build_balanced. existing nodes are reused in both strategies.
+
+	@type items: iterable
+	@param items: (key, value) pairs in any order
+	@rtype: (int,int,int)
+	@returns: a 3-tuple (k,e,h) where k is the number of new keys, e is the number of tree nodes
+	visited and h is the number of PROMOTE cases during the rebalancing.
+	keys that already appear in the dictionary get the new value; within the batch the last value wins
+	@complexity: O(m log(n/m + 1)) for a batch of m items, plus O(m log m) to sort it
+	"""
+	def insert_many(self, items):
+		batch = {}
+		for key, val in items:
+			batch[key] = val
+		keys = sorted(batch)
+		values = [batch[key] for key in keys]
+		old_size = self.treeSize
+
+		# nodes are only created for the keys that are missing, existing ones just get the new value
+		if len(keys) * AVLTree.BULK_REBUILD_RATIO >= old_size:
+			merged = []
+			existing = list(self.iter_nodes())
+			i = 0
+			for node in existing:
+				while i < len(keys) and keys[i] < node.key:
+					merged.append(self.new_node(keys[i], values[i]))
+					i += 1
+				if i < len(keys) and keys[i] == node.key:
+					node = self.own(node, detached=True)
+					node.value = values[i]
+					i += 1
+				merged.append(node)
+			merged.extend(self.new_node(keys[k], values[k]) for k in range(i, len(keys)))
+
+			self.set_root(self.build_balanced(iter(merged), len(merged)))
+			return self.treeSize - old_size, len(existing), 0
+
+		counters = [0, 0]  # nodes visited, promotes
+		root = self.root if self.root is not None else self.ext_leaf
+		self.set_root(self.insert_many_rec(root, keys, values, 0, len(keys), counters))
+		return self.treeSize - old_size, counters[0], counters[1]
+
+
+	"""recursive call for insert_many, merges keys[lo:hi] with their values into the detached subtree rooted at node
+
+	@rtype: AVLNode
+	@returns: the root of the merged subtree
+	@complexity: O(m log(n/m + 1))
+	"""
+	def insert_many_rec(self, node, keys, values, lo, hi, counters):
+		if lo == hi:
+			return node
+		if not node.is_real_node():
+			return self.build_balanced((self.new_node(keys[k], values[k]) for k in range(lo, hi)), hi - lo)
+
+		counters[0] += 1
+		node = self.own(node)
+		i = bisect_left(keys, node.key, lo, hi)
+		j = i
+		if i < hi and keys[i] == node.key:
+			node.value = values[i]
+			j += 1
+
+		left, right = self.expose(node)
+		left = self.insert_many_rec(left, keys, values, lo, i, counters)
+		right = self.insert_many_rec(right, keys, values, j, hi, counters)
+		root, promotes = self.join_nodes(left, node, right)
+		counters[1] += promotes
+		return root
+
+
+	"""deletes a batch of keys, rebalancing once per batch instead of once per key
+
+	uses the same two strategies as insert_many: divide and conquer with join_nodes/join2_nodes
+	for small batches and a rebuild from the surviving nodes for large ones.
+
+	@type keys: iterable
+	@param keys: keys or AVLNodes of self to delete, keys that do not appear are ignored
+	@rtype: (int,int,int)
+	@returns: a 3-tuple (k,e,h) where k is the number of deleted keys, e is the number of tree nodes
+	visited and h is the number of PROMOTE cases during the rebalancing
+	@complexity: O(m log(n/m + 1)) for a batch of m keys, plus O(m log m) to sort it
+	"""
+	def delete_many(self, keys):
+		keys = sorted(set(key.key if isinstance(key, AVLNode) else key for key in keys))
+		old_size = self.treeSize
+		if self.root is None or not keys:
+			return 0, 0, 0
+
+		if len(keys) * AVLTree.BULK_REBUILD_RATIO >= old_size:
+			existing = list(self.iter_nodes())
+			kept = []
+			i = 0
+			for node in existing:
+				while i < len(keys) and keys[i] < node.key:
+					i += 1
+				if i < len(keys) and keys[i] == node.key:
+					continue
+				kept.append(node)
+
+			self.set_root(self.build_balanced(iter(kept), len(kept)))
+			return old_size - self.treeSize, len(existing), 0
+
+		counters = [0, 0]
+		self.set_root(self.delete_many_rec(self.root, keys, 0, len(keys), counters))
+		return old_size - self.treeSize, counters[0], counters[1]
+
+
+	"""recursive call for delete_many, removes keys[lo:hi] from the detached subtree rooted at node
+
+	@rtype: AVLNode
+	@returns: the root of the remaining subtree
+	@complexity: O(m log(n/m + 1))
+	"""
+	def delete_many_rec(self, node, keys, lo, hi, counters):
+		if lo == hi or not node.is_real_node():
+			return node
+
+		counters[0] += 1
+		i = bisect_left(keys, node.key, lo, hi)
+		found = i < hi and keys[i] == node.key
+
+		left, right = self.expose(node)
+		left = self.delete_many_rec(left, keys, lo, i, counters)
+		right = self.delete_many_rec(right, keys, i + found, hi, counters)
+		if found:
+			root, promotes = self.join2_nodes(left, right)
+		else:
+			root, promotes = self.join_nodes(left, node, right)
+		counters[1] += promotes
+		return root
+
+
+	"""adds the items of another dictionary to self with split/join divide and conquer
+
+	the root of the smaller of the two (sub)trees splits the other one, both halves are merged
+	recursively and joined back around that root, so a small tree is merged into a large one
+	without touching most of it.
+
+	@type other: AVLTree
+	@param other: the dictionary to merge in, it is left empty
+	@type merge: function
+	@param merge: merge(value, other_value) returns the value of a key that is in both,
+	other_value if None
+	@complexity: O(m log(n/m + 1)) where m is the size of the smaller dictionary
+	"""
+	def union(self, other, merge=None):
+		if merge is None:
+			merge = lambda value, other_value: other_value
+		self.set_root(self.set_operation(other, self.union_nodes, merge))
+
+
+	"""keeps only the keys of self that are also in another dictionary
+
+	@type other: AVLTree
+	@param other: the dictionary to intersect with, it is left empty
+	@type merge: function
+	@param merge: merge(value, other_value) returns the value of a kept key, other_value if None
+	@complexity: O(m log(n/m + 1)) where m is the size of the smaller dictionary
+	"""
+	def intersection(self, other, merge=None):
+		if merge is None:
+			merge = lambda value, other_value: other_value
+		self.set_root(self.set_operation(other, self.intersection_nodes, merge))
+
+
+	"""removes the keys of another dictionary from self
+
+	@type other: AVLTree
+	@param other: the dictionary of keys to remove, it is left empty
+	@type merge: function
+	@param merge: if given, a key that is in both is kept with the value merge(value, other_value)
+	unless that is None (e.g. to subtract counts)
+	@complexity: O(m log(n/m + 1)) where m is the size of the smaller dictionary
+	"""
+	def difference(self, other, merge=None):
+		self.set_root(self.set_operation(other, self.difference_nodes, merge))
+
+
+	"""detaches both roots and runs a node level set operation on them
+
+	@type other: AVLTree
+	@param other: the second operand, it is left empty
+	@type operation: function
+	@param operation: one of union_nodes, intersection_nodes and difference_nodes
+	@rtype: AVLNode
+	@returns: the root of the result
+	"""
+	def set_operation(self, other, operation, merge):
+		if other is self:
+			raise ValueError("a dictionary cannot be combined with itself")
+
+		self.inherit_sharing(other)
+		a = self.root if self.root is not None else self.ext_leaf
+		b = other.root if other.root is not None else self.ext_leaf
+		other.set_root(None)
+		return operation(a, b, merge)
+
+
+	"""splits the larger of two detached subtrees by the root of the smaller one
+
+	@type a: AVLNode
+	@param a: a real subtree root of self
+	@type b: AVLNode
+	@param b: a real subtree root of the other dictionary
+	@rtype: tuple
+	@returns: (a_left, a_mid, a_right, b_left, b_mid, b_right) where one of a_mid, b_mid is the
+	exposed root and the other is the node with the same key (None if there is none)
+	@complexity: O(log n)
+	"""
+	def split_by_smaller(self, a, b):
+		if a.size < b.size:
+			a_left, a_right = self.expose(a)
+			b_left, b_mid, b_right = self.split_nodes(b, a.key)
+			return a_left, a, a_right, b_left, b_mid, b_right
+
+		b_left, b_right = self.expose(b)
+		a_left, a_mid, a_right = self.split_nodes(a, b.key)
+		return a_left, a_mid, a_right, b_left, b, b_right
+
+
+	"""joins two subtrees around a node that takes a new value, or without a separator if node is None
+
+	@rtype: AVLNode
+	@returns: the root of the joined subtree
+	@complexity: O(log n)
+	"""
+	def join_with_value(self, left, node, value, right):
+		if node is None:
+			root, _ = self.join2_nodes(left, right)
+			return root
+
+		node = self.own(node, detached=True)
+		node.value = value
+		root, _ = self.join_nodes(left, node, right)
+		return root
+
+
+	"""the union of two detached subtrees, see union
+
+	@rtype: AVLNode
+	@returns: the root of the result (may be virtual)
+	"""
+	def union_nodes(self, a, b, merge):
+		if not b.is_real_node():
+			return a
+		if not a.is_real_node():
+			return b
+
+		a_left, a_mid, a_right, b_left, b_mid, b_right = self.split_by_smaller(a, b)
+		left = self.union_nodes(a_left, b_left, merge)
+		right = self.union_nodes(a_right, b_right, merge)
+		if a_mid is None:
+			return self.join_with_value(left, b_mid, b_mid.value, right)
+		if b_mid is None:
+			return self.join_with_value(left, a_mid, a_mid.value, right)
+		return self.join_with_value(left, a_mid, merge(a_mid.value, b_mid.value), right)
+
+
+	"""the intersection of two detached subtrees, see intersection
+
+	@rtype: AVLNode
+	@returns: the root of the result (may be virtual)
+	"""
+	def intersection_nodes(self, a, b, merge):
+		if not a.is_real_node() or not b.is_real_node():
+			return self.ext_leaf
+
+		a_left, a_mid, a_right, b_left, b_mid, b_right = self.split_by_smaller(a, b)
+		left = self.intersection_nodes(a_left, b_left, merge)
+		right = self.intersection_nodes(a_right, b_right, merge)
+		if a_mid is None or b_mid is None:
+			return self.join_with_value(left, None, None, right)
+		return self.join_with_value(left, a_mid, merge(a_mid.value, b_mid.value), right)
+
+
+	"""the difference of two detached subtrees, see difference
+
+	@rtype: AVLNode
+	@returns: the root of the result (may be virtual)
+	"""
+	def difference_nodes(self, a, b, merge):
+		if not a.is_real_node() or not b.is_real_node():
+			return a
+
+		a_left, a_mid, a_right, b_left, b_mid, b_right = self.split_by_smaller(a, b)
+		left = self.difference_nodes(a_left, b_left, merge)
+		right = self.difference_nodes(a_right, b_right, merge)
+		if a_mid is None:
+			return self.join_with_value(left, None, None, right)
+		if b_mid is None:
+			return self.join_with_value(left, a_mid, a_mid.value, right)
+
+		value = merge(a_mid.value, b_mid.value) if merge is not None else None
+		return self.join_with_value(left, a_mid if value is not None else None, value, right)
+
+
 	"""searches through the tree and returns the minimal node in the dictionary
 		@rtype: AVLNode
 		@returns: the minimal node, None of the dictionary is empty
@@ -783,8 +2160,10 @@ class AVLTree(object):
 	"""
 	def find_min(self):
 		node = self.root
+		if node is None:
+			return None
 
-		while(node.left.is_real_node == True):
+		while node.left.is_real_node():
 			node = node.left
 		
 		return node
@@ -798,73 +2177,560 @@ class AVLTree(object):
 	"""
 	def find_max(self):
 		node = self.root
+		if node is None:
+			return None
 
-		while(node.right.is_real_node == True):
+		while node.right.is_real_node():
 			node = node.right
 
 		return node
 	
 	"""returns an array representing dictionary 
 
-	@rtype: list
-	@returns: a sorted list according to key of tuples (key, value) representing the data structure
-	@complexity: O(n)
-	"""
-	def avl_to_array(self):
-		arr_in_order = []
-		self.avl_to_array_rec(self.root, arr_in_order)
-		return arr_in_order
-	
+	@rtype: list
+	@returns: a sorted list according to key of tuples (key, value) representing the data structure
+	@complexity: O(n)
+	"""
+	def avl_to_array(self):
+		return list(self.items())
+
+
+	"""copies the dictionary into an immutable read-optimized FrozenAVLTree
+
+	@rtype: FrozenAVLTree
+	@returns: a frozen copy, self is not changed
+	@complexity: O(n)
+	"""
+	def freeze(self):
+		return FrozenAVLTree(self.items(), self.treeSize)
+
+
+	"""writes the dictionary to a file, to be read back with load or MappedAVLTree
+
+	the file holds a header, the sorted keys as one array of int64 (all keys int) or float64 (all
+	keys float) and the values as an array of offsets into a blob - utf-8 if all the values are
+	strings, raw if they are all bytes and pickled otherwise. it is written next to path and renamed
+	over it once complete.
+
+	@type path: string
+	@param path: the file to write. TypeError is raised for any other mix of key types and
+	OverflowError for int keys outside the int64 range, so keys always load back unchanged
+	@complexity: O(n)
+	"""
+	def dump(self, path):
+		key_list = list(self.keys())
+		if all(type(key) is int for key in key_list):
+			try:
+				keys = array('q', key_list)
+			except OverflowError:
+				raise OverflowError("dump supports int keys in the int64 range only")
+		elif all(type(key) is float for key in key_list):
+			keys = array('d', key_list)
+		else:
+			raise TypeError("dump supports keys that are all int or all float only")
+
+		values = list(self.values())
+		if all(type(val) is str for val in values):
+			value_code, blobs = b's', [val.encode('utf-8') for val in values]
+		elif all(type(val) is bytes for val in values):
+			value_code, blobs = b'b', values
+		else:
+			value_code, blobs = b'p', [pickle.dumps(val, pickle.HIGHEST_PROTOCOL) for val in values]
+
+		offsets = array('Q', [0])
+		for blob in blobs:
+			offsets.append(offsets[-1] + len(blob))
+
+		byte_order = b'<' if sys.byteorder == 'little' else b'>'
+		header = self.DUMP_HEADER.pack(self.DUMP_MAGIC, self.DUMP_VERSION, byte_order,
+			keys.typecode.encode('ascii'), value_code, len(keys))
+		tmp_path = path + '.tmp'
+		with open(tmp_path, 'wb') as f:
+			f.write(header)
+			keys.tofile(f)
+			offsets.tofile(f)
+			f.writelines(blobs)
+		os.replace(tmp_path, path)
+
+
+	"""lazily walks the nodes in increasing key order using the parent pointers
+
+	@type node: AVLNode
+	@param node: the node to start from (inclusive), the minimal node if None
+	@rtype: generator
+	@returns: a generator of AVLNode, the dictionary must not be modified while it is consumed
+	@complexity: O(1) amortized per step, O(1) extra memory
+	"""
+	def iter_nodes(self, node=None):
+		if node is None:
+			node = self.minNode
+
+		# "key is not None" is the inlined is_real_node() check
+		while node is not None:
+			yield node
+			if node.right.key is not None:
+				node = node.right
+				while node.left.key is not None:
+					node = node.left
+			else:
+				while node.parent is not None and node is node.parent.right:
+					node = node.parent
+				node = node.parent
+
+
+	"""lazily walks the nodes in decreasing key order using the parent pointers
+
+	@type node: AVLNode
+	@param node: the node to start from (inclusive), the maximal node if None
+	@rtype: generator
+	@returns: a generator of AVLNode, the dictionary must not be modified while it is consumed
+	@complexity: O(1) amortized per step, O(1) extra memory
+	"""
+	def iter_nodes_reversed(self, node=None):
+		if node is None:
+			node = self.maxNode
+
+		while node is not None:
+			yield node
+			if node.left.key is not None:
+				node = node.left
+				while node.right.key is not None:
+					node = node.right
+			else:
+				while node.parent is not None and node is node.parent.left:
+					node = node.parent
+				node = node.parent
+
+
+	"""iterates over the keys in increasing order
+
+	@rtype: generator
+	@complexity: O(n) for a full scan
+	"""
+	def __iter__(self):
+		for node in self.iter_nodes():
+			yield node.key
+
+
+	"""iterates over the keys in decreasing order
+
+	@rtype: generator
+	@complexity: O(n) for a full scan
+	"""
+	def __reversed__(self):
+		for node in self.iter_nodes_reversed():
+			yield node.key
+
+
+	"""returns the number of items in dictionary
+
+	@rtype: int
+	@complexity: O(1)
+	"""
+	def __len__(self):
+		return self.treeSize
+
+
+	"""iterates over the (key, value) pairs in increasing key order
+
+	@rtype: generator
+	@complexity: O(n) for a full scan
+	"""
+	def items(self):
+		for node in self.iter_nodes():
+			yield (node.key, node.value)
+
+
+	"""iterates over the keys in increasing order
+
+	@rtype: generator
+	@complexity: O(n) for a full scan
+	"""
+	def keys(self):
+		return iter(self)
+
+
+	"""iterates over the values in increasing key order
+
+	@rtype: generator
+	@complexity: O(n) for a full scan
+	"""
+	def values(self):
+		for node in self.iter_nodes():
+			yield node.value
+
+
+	"""iterates over the (key, value) pairs in decreasing key order
+
+	@rtype: generator
+	@complexity: O(n) for a full scan
+	"""
+	def reversed(self):
+		for node in self.iter_nodes_reversed():
+			yield (node.key, node.value)
+
+	"""returns the node with the maximal key in the dictionary
+
+	@rtype: AVLNode
+	@returns: the maximal node, None if the dictionary is empty
+	complexity: O(1)
+	"""
+	def max_node(self):
+		return self.maxNode
+	
+	"""Returns the node with the minimal key in the dictionary
+	
+	@rtype: AVLNode
+	@returns: the minimal node, None if the dicionary is empty
+	@complexity: O(1)
+	"""
+	def min_node(self):
+		return self.minNode
+
+
+	"""returns the root of the tree representing the dictionary
+
+	@rtype: AVLNode
+	@returns: the root, None if the dictionary is empty
+	@complexity: O(1)
+	"""
+	def get_root(self):
+		return self.root
+	
+	"""returns the number of items in dictionary 
+
+	@rtype: int
+	@returns: the number of items in dictionary 
+	@complexity: O(1)
+	"""
+	def size(self):
+		return self.treeSize
+
+
+	"""starts recycling deleted nodes: delete, delete_key, pop_min and pop_max give the node they
+	remove to a pool (up to capacity nodes) after clearing its links and value, and new_node takes
+	nodes from the pool before allocating. delete_key, pop_min and pop_max return the deleted
+	(key, value) item instead of the node meanwhile, and handles of deleted nodes must not be kept
+
+	@type capacity: int
+	@param capacity: the maximal number of pooled nodes
+	@complexity: O(1)
+	"""
+	def enable_pool(self, capacity=1024):
+		if capacity < 0:
+			raise ValueError("the pool capacity must not be negative")
+		if self.pool is None:
+			self.pool = []
+		self.pool_capacity = capacity
+		del self.pool[capacity:]
+
+
+	"""stops recycling nodes and drops the pooled ones
+
+	@complexity: O(1)
+	"""
+	def disable_pool(self):
+		self.pool = None
+		self.pool_capacity = 0
+
+
+	"""gives a deleted node to the pool if there is room, clearing its links to the tree and the
+	references to the value. nodes that may still be shared with a snapshot are never pooled
+
+	@type node: AVLNode
+	@param node: a node that was just removed from self
+	@complexity: O(1)
+	"""
+	def recycle(self, node):
+		if len(self.pool) >= self.pool_capacity or node.epoch != self.epoch:
+			return
+		node.left = None
+		node.right = None
+		node.parent = None
+		node.value = None
+		node.agg = None
+		node.generation += 1
+		self.pool.append(node)
+		if self.counters is not None:
+			self.counters.pool_returns += 1
+
+
+	"""starts counting rotations, promotions, demotions, search paths, finger climbs, delete
+	rebalance iterations, node allocations and the pauses of the garbage collector (until
+	disable_stats). while it is off the hot paths only check that self.counters is None
+
+	@complexity: O(1)
+	"""
+	def enable_stats(self):
+		if self.counters is None:
+			self.counters = AVLStats()
+			AVLStats.watching.add(self.counters)
+			if gc_callback not in gc.callbacks:
+				gc.callbacks.append(gc_callback)
+
+
+	"""stops counting and drops the counters
+
+	@complexity: O(1)
+	"""
+	def disable_stats(self):
+		if self.counters is not None:
+			AVLStats.watching.discard(self.counters)
+		self.counters = None
+
+
+	"""sets all the counters back to zero
+
+	@complexity: O(1)
+	"""
+	def reset_stats(self):
+		if self.counters is not None:
+			self.counters.reset()
+
+
+	"""returns the counters gathered since enable_stats or the last reset_stats
+
+	@rtype: dict
+	@returns: see AVLStats.as_dict, None if stats are not enabled
+	"""
+	def stats(self):
+		if self.counters is None:
+			return None
+		return self.counters.as_dict()
+
+
+	"""returns the number of keys in the dictionary that are smaller than key
+
+	@type key: int
+	@param key: any key, it does not have to appear in the dictionary
+	@rtype: int
+	@returns: the rank of key, i.e. the index it has (or would have) in avl_to_array()
+	@complexity: O(log n)
+	"""
+	def rank(self, key):
+		count = 0
+		node = self.root
+
+		while node is not None and node.is_real_node():
+			if key > node.key:
+				count += node.left.size + 1
+				node = node.right
+			else:
+				node = node.left
+
+		return count
+
+
+	"""returns the node holding the k-th smallest key (counting from 0)
+
+	@type k: int
+	@param k: the index of the requested key in avl_to_array()
+	@rtype: AVLNode
+	@returns: the k-th node, None if k is out of range
+	@complexity: O(log n)
+	"""
+	def select(self, k):
+		if k < 0 or k >= self.treeSize:
+			return None
+
+		node = self.root
+		while True:
+			left_size = node.left.size
+			if k < left_size:
+				node = node.left
+			elif k == left_size:
+				return node
+			else:
+				k -= left_size + 1
+				node = node.right
+
+
+	"""returns the number of keys in the half open range [lo, hi)
+
+	@type lo: int
+	@param lo: the inclusive lower bound
+	@type hi: int
+	@param hi: the exclusive upper bound
+	@rtype: int
+	@complexity: O(log n)
+	"""
+	def count_range(self, lo, hi):
+		if hi <= lo:
+			return 0
+		return self.rank(hi) - self.rank(lo)
+
+
+	"""returns the node at the given percentile of the keys (nearest rank method)
+
+	@type p: float
+	@param p: a percentile between 0 and 100, e.g. 50 for the median and 99 for p99
+	@rtype: AVLNode
+	@returns: the smallest node such that at least p percent of the keys are not larger than it,
+	None if the dictionary is empty
+	@complexity: O(log n)
+	"""
+	def percentile(self, p):
+		if p < 0 or p > 100:
+			raise ValueError("percentile must be between 0 and 100")
+		if self.treeSize == 0:
+			return None
+
+		k = -(-p * self.treeSize // 100)  # ceil without floating point rounding for integral p
+		return self.select(max(int(k), 1) - 1)
+
+
+	"""same as count_range, returns the number of keys in [lo, hi)
+
+	@type lo: int
+	@param lo: the inclusive lower bound
+	@type hi: int
+	@param hi: the exclusive upper bound
+	@rtype: int
+	@complexity: O(log n)
+	"""
+	def range_count(self, lo, hi):
+		return self.count_range(lo, hi)
+
+
+	"""combines the aggregate kept by the tree over the values of the keys in [lo, hi), in key order
+
+	the walk goes down to the first node inside the range, then along the paths to lo and to hi,
+	taking the cached aggregate of every subtree that lies inside the range as a whole.
+
+	@type lo: int
+	@param lo: the inclusive lower bound
+	@type hi: int
+	@param hi: the exclusive upper bound
+	@returns: the aggregate of the range, the identity if it is empty
+	@complexity: O(log n) calls of combine
+	"""
+	def aggregate(self, lo, hi):
+		if self.monoid is None:
+			raise ValueError("the dictionary was created without an aggregate")
+		identity, combine, lift = self.monoid
+
+		node = self.root
+		while node is not None and node.is_real_node():
+			if node.key < lo:
+				node = node.right
+			elif not node.key < hi:
+				node = node.left
+			else:
+				break
+		if node is None or not node.is_real_node():
+			return identity
+
+		# the keys >= lo of the left subtree, collected from the right end
+		head = identity
+		curr = node.left
+		while curr.is_real_node():
+			if curr.key < lo:
+				curr = curr.right
+			else:
+				head = combine(combine(lift(curr.value), curr.right.agg), head)
+				curr = curr.left
+
+		# the keys < hi of the right subtree, collected from the left end
+		tail = identity
+		curr = node.right
+		while curr.is_real_node():
+			if curr.key < hi:
+				tail = combine(tail, combine(curr.left.agg, lift(curr.value)))
+				curr = curr.right
+			else:
+				curr = curr.left
+
+		return combine(combine(head, lift(node.value)), tail)
+
+
+	"""returns the node with the smallest key that is at least key
+
+	@type key: int
+	@param key: any key, it does not have to appear in the dictionary
+	@rtype: AVLNode
+	@returns: the first node not smaller than key, None if there is none
+	@complexity: O(log n)
+	"""
+	def lower_bound(self, key):
+		found = None
+		node = self.root
+
+		while node is not None and node.is_real_node():
+			if node.key < key:
+				node = node.right
+			else:
+				found = node
+				node = node.left
+
+		return found
 
-	"""recursive call for avl_to_array
-	@param node: the current node
-	@type node: AVLNode
-	@param arr: an array using memoization
-	@type arr: list
-	@complexity: O(n)
-	"""
-	def avl_to_array_rec(self,node,arr):
-		if node and node.is_real_node():
-			self.avl_to_array_rec(node.left,arr)
-			arr.append((node.key, node.value))  # append array with tuple (key, value)
-			self.avl_to_array_rec(node.right,arr)
 
-	"""returns the node with the maximal key in the dictionary
+	"""returns a cursor on the smallest key that is at least key
 
-	@rtype: AVLNode
-	@returns: the maximal node, None if the dictionary is empty
-	complexity: O(1)
+	@type key: int
+	@param key: any key, it does not have to appear in the dictionary
+	@rtype: Cursor
+	@returns: a cursor on the first node not smaller than key, past the end if there is none
+	@complexity: O(log n)
 	"""
-	def max_node(self):
-		return self.maxNode
-	
-	"""Returns the node with the minimal key in the dictionary
-	
-	@rtype: AVLNode
-	@returns: the minimal node, None if the dicionary is empty
-	@complexity: O(1)
+	def seek(self, key):
+		cursor = Cursor(self)
+		cursor.node = self.lower_bound(key)
+		cursor.past_end = cursor.node is None
+		if cursor.node is not None:
+			cursor.current = cursor.node.key
+			cursor.generation = cursor.node.generation
+		return cursor
+
+
+	"""lazily iterates over the (key, value) pairs with lo <= key < hi in increasing key order
+
+	@type lo: int
+	@param lo: the inclusive lower bound
+	@type hi: int
+	@param hi: the exclusive upper bound
+	@rtype: generator
+	@returns: a generator of (key, value), the dictionary must not be modified while it is consumed
+	@complexity: O(log n) to reach lo, then O(1) amortized per item
 	"""
-	def min_node(self):
-		return self.minNode
+	def range_items(self, lo, hi):
+		start = self.lower_bound(lo)
+		if start is None:
+			return
 
+		for node in self.iter_nodes(start):
+			if not node.key < hi:
+				return
+			yield (node.key, node.value)
 
-	"""returns the root of the tree representing the dictionary
 
-	@rtype: AVLNode
-	@returns: the root, None if the dictionary is empty
-	@complexity: O(1)
-	"""
-	def get_root(self):
-		return self.root
-	
-	"""returns the number of items in dictionary 
+	"""deletes all the keys in [lo, hi) with two splits and a join instead of one delete per key
 
+	@type lo: int
+	@param lo: the inclusive lower bound
+	@type hi: int
+	@param hi: the exclusive upper bound
 	@rtype: int
-	@returns: the number of items in dictionary 
-	@complexity: O(1)
+	@returns: the number of deleted keys
+	@complexity: O(log n)
 	"""
-	def size(self):
-		return self.treeSize
+	def delete_range(self, lo, hi):
+		if self.root is None or not lo < hi:
+			return 0
+
+		# keys < lo | keys >= lo
+		before, mid, rest = self.split_nodes(self.root, lo)
+		if mid is not None:
+			rest, _ = self.join_nodes(self.ext_leaf, mid, rest)
+
+		# keys in [lo, hi) | keys >= hi
+		removed, mid, after = self.split_nodes(rest, hi)
+		if mid is not None:
+			after, _ = self.join_nodes(self.ext_leaf, mid, after)
+
+		root, _ = self.join2_nodes(before, after)
+		self.set_root(root)
+		return removed.size
 
 
 	"""find the successor of a node
@@ -936,8 +2802,8 @@ class AVLTree(object):
     """
 	def right_rotation(self,root):
 		# names as shown in lecture notes p.27
-		y = root
-		x = y.left
+		y = self.own(root)
+		x = self.own(y.left)
 		c = y.right
 		a = x.left
 		b = x.right
@@ -972,6 +2838,8 @@ class AVLTree(object):
 		# fix heights
 		y.height = max(b.height, c.height) + 1
 		x.height = max(a.height, y.height) + 1
+		self.refresh(y)
+		self.refresh(x)
 
 
 	"""rotates an AVL subtree rooted at the given node once to the left
@@ -983,8 +2851,8 @@ class AVLTree(object):
     """
 	def left_rotation(self,root):
 		# names as shown in AVL lecture notes p.27
-		x = root
-		y = x.right
+		x = self.own(root)
+		y = self.own(x.right)
 		a = x.left
 		b = y.left
 		c = y.right
@@ -1019,6 +2887,680 @@ class AVLTree(object):
 		# fix heights
 		x.height =  max(a.height, b.height) + 1
 		y.height = max(x.height, c.height) + 1
+		self.refresh(x)
+		self.refresh(y)
+
+
+"""
+A position in an AVLTree that steps through the keys in both directions.
+
+the cursor is on a node, in the gap below a key that was deleted under it, or off one end of the
+keys. stepping from a node follows the child and parent pointers, which costs O(1) amortized over
+a scan. every change to the node structure bumps AVLTree.modcount, and a cursor that sees a new
+modcount looks its key up again before it moves or reads (O(log n) once), so scans survive
+insertions and deletions between the steps. if its key was deleted by someone else the cursor
+stays in the gap: next() moves to the first larger key and prev() to the last smaller one.
+"""
+
+class Cursor(object):
+	__slots__ = ('tree', 'node', 'current', 'generation', 'gap', 'past_end', 'modcount')
+
+	"""
+	Constructor, used by AVLTree.seek. the cursor starts before the first key.
+
+	@type tree: AVLTree
+	@param tree: the tree the cursor moves in
+	@complexity: O(1) worst case
+	"""
+	def __init__(self, tree):
+		self.tree = tree
+		self.node = None  # the current node, None in a gap or off the ends
+		self.current = None  # the key of node, kept since a pooled node may hold another key after a change
+		self.generation = 0  # the generation of node when the cursor moved to it
+		self.gap = None  # the key the cursor stands just below when it is in a gap
+		self.past_end = False  # off the ends: True after the last key, False before the first one
+		self.modcount = tree.modcount
+
+
+	"""looks the current key up again if the tree changed since the cursor last looked
+
+	a node that was not pooled since the cursor moved to it still holds the cursor's item, so a key
+	it got from decrease_key is followed. a pooled node may hold another item, the saved key is
+	looked up instead.
+
+	@complexity: O(1) if the tree did not change, O(log n) otherwise
+	"""
+	def sync(self):
+		tree = self.tree
+		if self.modcount == tree.modcount:
+			return
+		self.modcount = tree.modcount
+		if self.node is not None:
+			if self.node.generation == self.generation:
+				self.current = self.node.key
+			self.node, _ = tree.search_or_parent(self.current)
+			if self.node is None:
+				self.gap = self.current
+				self.current = None
+
+
+	"""returns whether the cursor is on a key
+
+	@rtype: bool
+	@complexity: O(1), O(log n) after a change to the tree
+	"""
+	def valid(self):
+		self.sync()
+		return self.node is not None
+
+
+	"""the current key, None if the cursor is not on a key"""
+	@property
+	def key(self):
+		self.sync()
+		return self.node.key if self.node is not None else None
+
+
+	"""the value of the current key, None if the cursor is not on a key"""
+	@property
+	def value(self):
+		self.sync()
+		return self.node.value if self.node is not None else None
+
+
+	"""moves to the next larger key
+
+	@rtype: bool
+	@returns: True if the cursor is on a key, False if it moved past the last one
+	@complexity: O(1) amortized over a scan, O(log n) worst case
+	"""
+	def next(self):
+		self.sync()
+		tree = self.tree
+		node = self.node
+		if node is not None:
+			succ = tree.find_successor(node)
+			node = succ if succ is not node else None
+		elif self.gap is not None:
+			node = tree.lower_bound(self.gap)
+		elif not self.past_end:
+			node = tree.minNode
+
+		self.node = node
+		self.current = node.key if node is not None else None
+		self.generation = node.generation if node is not None else 0
+		self.gap = None
+		self.past_end = node is None
+		return node is not None
+
+
+	"""moves to the next smaller key
+
+	@rtype: bool
+	@returns: True if the cursor is on a key, False if it moved before the first one
+	@complexity: O(1) amortized over a scan, O(log n) worst case
+	"""
+	def prev(self):
+		self.sync()
+		tree = self.tree
+		node = self.node
+		if node is not None:
+			pred = tree.find_predecessor(node)
+			node = pred if pred is not node else None
+		elif self.gap is not None:
+			above = tree.lower_bound(self.gap)
+			if above is None:
+				node = tree.maxNode
+			else:
+				pred = tree.find_predecessor(above)
+				node = pred if pred is not above else None
+		elif self.past_end:
+			node = tree.maxNode
+
+		self.node = node
+		self.current = node.key if node is not None else None
+		self.generation = node.generation if node is not None else 0
+		self.gap = None
+		self.past_end = False
+		return node is not None
+
+
+	"""deletes the current key, the cursor stays in its gap
+
+	@rtype: bool
+	@returns: True if a key was deleted, False if the cursor was not on a key
+	@complexity: O(log n)
+	"""
+	def delete(self):
+		self.sync()
+		node = self.node
+		if node is None:
+			return False
+
+		self.gap = self.current
+		self.node = None
+		self.current = None
+		self.tree.delete(node)
+		self.modcount = self.tree.modcount
+		return True
+
+
+"""
+A read-only view of an AVLTree at the moment AVLTree.snapshot() was called.
+"""
+
+class AVLSnapshot(object):
+
+	"""
+	Constructor, called by AVLTree.snapshot.
+
+	@type tree: AVLTree
+	@param tree: the tree the snapshot is taken of
+	@complexity: O(1) worst case
+	"""
+	def __init__(self, tree):
+		self.root = tree.root
+		self.minNode = tree.minNode
+		self.maxNode = tree.maxNode
+		self.treeSize = tree.treeSize
+		self.counters = None
+		self.monoid = tree.monoid
+
+
+	# the queries that only walk down from the root are shared with AVLTree
+	search = AVLTree.search
+	search_from = AVLTree.search_from
+	rank = AVLTree.rank
+	select = AVLTree.select
+	count_range = AVLTree.count_range
+	range_count = AVLTree.range_count
+	percentile = AVLTree.percentile
+	lower_bound = AVLTree.lower_bound
+	max_node = AVLTree.max_node
+	min_node = AVLTree.min_node
+	get_root = AVLTree.get_root
+	size = AVLTree.size
+	__len__ = AVLTree.__len__
+	__iter__ = AVLTree.__iter__
+	__reversed__ = AVLTree.__reversed__
+	items = AVLTree.items
+	keys = AVLTree.keys
+	values = AVLTree.values
+	reversed = AVLTree.reversed
+	avl_to_array = AVLTree.avl_to_array
+	aggregate = AVLTree.aggregate
+
+
+	"""lazily walks the nodes in increasing key order with an explicit stack
+
+	the parent pointers belong to the live tree, so unlike AVLTree.iter_nodes this never follows them.
+
+	@type lo: int
+	@param lo: only nodes whose key is at least lo are visited, all nodes if None
+	@rtype: generator
+	@returns: a generator of AVLNode
+	@complexity: O(1) amortized per step, O(log n) extra memory
+	"""
+	def iter_nodes(self, lo=None):
+		stack = []
+		node = self.root
+		while node is not None and node.is_real_node():
+			if lo is None or not node.key < lo:
+				stack.append(node)
+				node = node.left
+			else:
+				node = node.right
+
+		while stack:
+			node = stack.pop()
+			yield node
+			node = node.right
+			while node.is_real_node():
+				stack.append(node)
+				node = node.left
+
+
+	"""lazily walks the nodes in decreasing key order with an explicit stack
+
+	@rtype: generator
+	@returns: a generator of AVLNode
+	@complexity: O(1) amortized per step, O(log n) extra memory
+	"""
+	def iter_nodes_reversed(self):
+		stack = []
+		node = self.root
+		while node is not None and node.is_real_node():
+			stack.append(node)
+			node = node.right
+
+		while stack:
+			node = stack.pop()
+			yield node
+			node = node.left
+			while node.is_real_node():
+				stack.append(node)
+				node = node.right
+
+
+	"""lazily iterates over the (key, value) pairs with lo <= key < hi in increasing key order
+
+	@type lo: int
+	@param lo: the inclusive lower bound
+	@type hi: int
+	@param hi: the exclusive upper bound
+	@rtype: generator
+	@complexity: O(log n) to reach lo, then O(1) amortized per item
+	"""
+	def range_items(self, lo, hi):
+		for node in self.iter_nodes(lo):
+			if not node.key < hi:
+				return
+			yield (node.key, node.value)
+
+
+# the (key, value) pairs returned by the array backed views, readable like an AVLNode
+Item = namedtuple('Item', ('key', 'value'))
+
+
+"""
+A read-only dictionary over a sorted array of keys, queried with binary search.
+
+subclasses provide self.keys_array (a sequence of the keys in increasing order), self.treeSize
+and value_at(i).
+"""
+
+class SortedArrayView(object):
+
+	# the queries written in terms of rank, select and treeSize are shared with AVLTree
+	count_range = AVLTree.count_range
+	range_count = AVLTree.range_count
+	percentile = AVLTree.percentile
+	size = AVLTree.size
+	__len__ = AVLTree.__len__
+	avl_to_array = AVLTree.avl_to_array
 
-                                                                                                                                     
-	
\ No newline at end of file
+
+	"""searches for a key
+
+	@type key: int
+	@param key: a key to be searched
+	@rtype: (Item,int)
+	@returns: a tuple (x,e) where x is the (key, value) Item of the key, or None if not found,
+	and e is the number of keys probed by the binary search
+	@complexity: O(log n)
+	"""
+	def search(self, key):
+		keys = self.keys_array
+		lo, hi = 0, self.treeSize
+		e = 0
+		while lo < hi:
+			mid = (lo + hi) // 2
+			e += 1
+			mid_key = keys[mid]
+			if mid_key == key:
+				return Item(mid_key, self.value_at(mid)), e
+			if mid_key < key:
+				lo = mid + 1
+			else:
+				hi = mid
+		return None, e
+
+
+	"""returns the number of keys in the dictionary that are smaller than key
+
+	@type key: int
+	@param key: any key, it does not have to appear in the dictionary
+	@rtype: int
+	@complexity: O(log n)
+	"""
+	def rank(self, key):
+		return bisect_left(self.keys_array, key)
+
+
+	"""returns the k-th smallest item (counting from 0)
+
+	@type k: int
+	@param k: the index of the requested key in avl_to_array()
+	@rtype: Item
+	@returns: the k-th item, None if k is out of range
+	@complexity: O(1)
+	"""
+	def select(self, k):
+		if k < 0 or k >= self.treeSize:
+			return None
+		return Item(self.keys_array[k], self.value_at(k))
+
+
+	"""returns the item with the smallest key that is at least key
+
+	@type key: int
+	@param key: any key, it does not have to appear in the dictionary
+	@rtype: Item
+	@returns: the first item not smaller than key, None if there is none
+	@complexity: O(log n)
+	"""
+	def lower_bound(self, key):
+		return self.select(self.rank(key))
+
+
+	"""returns the item with the minimal key, None if the dictionary is empty
+
+	@rtype: Item
+	@complexity: O(1)
+	"""
+	def min_node(self):
+		return self.select(0)
+
+
+	"""returns the item with the maximal key, None if the dictionary is empty
+
+	@rtype: Item
+	@complexity: O(1)
+	"""
+	def max_node(self):
+		return self.select(self.treeSize - 1)
+
+
+	"""lazily iterates over the (key, value) pairs with lo <= key < hi in increasing key order
+
+	@type lo: int
+	@param lo: the inclusive lower bound
+	@type hi: int
+	@param hi: the exclusive upper bound
+	@rtype: generator
+	@complexity: O(log n) to reach lo, then O(1) per item
+	"""
+	def range_items(self, lo, hi):
+		keys = self.keys_array
+		for i in range(self.rank(lo), self.rank(hi) if lo < hi else 0):
+			yield (keys[i], self.value_at(i))
+
+
+	"""iterates over the keys in increasing order
+
+	@rtype: iterator
+	@complexity: O(n) for a full scan
+	"""
+	def __iter__(self):
+		return iter(self.keys_array)
+
+
+	"""iterates over the keys in decreasing order
+
+	@rtype: iterator
+	@complexity: O(n) for a full scan
+	"""
+	def __reversed__(self):
+		return reversed(self.keys_array)
+
+
+	"""iterates over the keys in increasing order
+
+	@rtype: iterator
+	@complexity: O(n) for a full scan
+	"""
+	def keys(self):
+		return iter(self)
+
+
+	"""iterates over the values in increasing key order
+
+	@rtype: generator
+	@complexity: O(n) for a full scan
+	"""
+	def values(self):
+		for i in range(self.treeSize):
+			yield self.value_at(i)
+
+
+	"""iterates over the (key, value) pairs in increasing key order
+
+	@rtype: generator
+	@complexity: O(n) for a full scan
+	"""
+	def items(self):
+		keys = self.keys_array
+		for i in range(self.treeSize):
+			yield (keys[i], self.value_at(i))
+
+
+	"""iterates over the (key, value) pairs in decreasing key order
+
+	@rtype: generator
+	@complexity: O(n) for a full scan
+	"""
+	def reversed(self):
+		keys = self.keys_array
+		for i in range(self.treeSize - 1, -1, -1):
+			yield (keys[i], self.value_at(i))
+
+
+"""
+A read-only dictionary served straight from a file written by AVLTree.dump.
+
+the file is memory-mapped and searched in place - no AVLNode is created, the keys are read from
+the page cache and a value is decoded only when it is returned.
+"""
+
+class MappedAVLTree(SortedArrayView):
+
+	"""
+	Constructor.
+
+	@type path: string
+	@param path: a file written by AVLTree.dump
+	@complexity: O(1) worst case
+	"""
+	def __init__(self, path):
+		self.file = open(path, 'rb')
+		try:
+			self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+		except Exception:
+			self.file.close()
+			raise
+
+		header = AVLTree.DUMP_HEADER
+		if len(self.map) < header.size:
+			self.close()
+			raise ValueError("%s is not an AVLTree dump" % (path,))
+		magic, version, byte_order, key_code, value_code, n = header.unpack_from(self.map, 0)
+		native = b'<' if sys.byteorder == 'little' else b'>'
+		if magic != AVLTree.DUMP_MAGIC or version != AVLTree.DUMP_VERSION:
+			self.close()
+			raise ValueError("%s is not an AVLTree dump" % (path,))
+		if byte_order != native:
+			self.close()
+			raise ValueError("%s was written with a different byte order" % (path,))
+
+		keys_start = header.size
+		offsets_start = keys_start + 8 * n
+		self.blob_start = offsets_start + 8 * (n + 1)
+		self.value_code = value_code
+		self.treeSize = n
+		self.view = memoryview(self.map)
+		self.keys_array = self.view[keys_start:offsets_start].cast(key_code.decode('ascii'))
+		self.offsets = self.view[offsets_start:self.blob_start].cast('Q')
+
+
+	"""decodes the value stored at an index
+
+	@type i: int
+	@param i: the index of the item, 0 <= i < n
+	@complexity: O(1) plus the size of the value
+	"""
+	def value_at(self, i):
+		raw = self.map[self.blob_start + self.offsets[i]:self.blob_start + self.offsets[i + 1]]
+		if self.value_code == b's':
+			return raw.decode('utf-8')
+		if self.value_code == b'b':
+			return raw
+		return pickle.loads(raw)
+
+
+	"""unmaps the file, the view cannot be used afterwards"""
+	def close(self):
+		for name in ('offsets', 'keys_array', 'view'):
+			view = self.__dict__.pop(name, None)
+			if view is not None:
+				view.release()
+		self.map.close()
+		self.file.close()
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+
+"""
+An immutable dictionary laid out in arrays for read-mostly phases, created by AVLTree.freeze().
+
+the keys and values are kept in sorted lists, searched with bisect. when numpy is installed and the
+keys are numbers, the keys are also stored in Eytzinger order - the implicit layout of a complete
+binary search tree in breadth first order, slot k having its children at 2k and 2k+1 - where
+search_many walks a whole batch of keys down one level per vectorized step, and the top levels that
+every search touches share a few cache lines.
+"""
+
+class FrozenAVLTree(SortedArrayView):
+
+	"""
+	Constructor.
+
+	@type items: iterable
+	@param items: (key, value) pairs in strictly increasing key order
+	@type n: int
+	@param n: the number of items, counted if None
+	@complexity: O(n)
+	"""
+	def __init__(self, items, n=None):
+		self.keys_array = []
+		self.values_list = []
+		for key, val in items:
+			self.keys_array.append(key)
+			self.values_list.append(val)
+		if n is not None and n != len(self.keys_array):
+			raise ValueError("expected %d items, got %d" % (n, len(self.keys_array)))
+		self.treeSize = n = len(self.keys_array)
+
+		self.layout = None
+		if numpy is not None and n > 0:
+			keys = numpy.asarray(self.keys_array)
+			if keys.ndim == 1 and keys.dtype.kind in 'iuf':
+				# slot 0 is unused, layout_rank[k] is the sorted index of the key in slot k
+				layout_rank = [0] * (n + 1)
+				self.fill_layout(layout_rank, 1, 0)
+				self.layout_rank = numpy.asarray(layout_rank, dtype=numpy.int64)
+				self.layout = keys[self.layout_rank]
+
+
+	"""assigns the sorted indices from i on to the Eytzinger slots of the subtree of slot k, in order
+
+	@type layout_rank: list
+	@param layout_rank: the slot -> sorted index table being filled
+	@rtype: int
+	@returns: the first index not assigned
+	@complexity: O(size of the subtree), recursion depth O(log n)
+	"""
+	def fill_layout(self, layout_rank, k, i):
+		if k > self.treeSize:
+			return i
+		i = self.fill_layout(layout_rank, 2 * k, i)
+		layout_rank[k] = i
+		return self.fill_layout(layout_rank, 2 * k + 1, i + 1)
+
+
+	"""returns the value stored at a sorted index
+
+	@complexity: O(1)
+	"""
+	def value_at(self, i):
+		return self.values_list[i]
+
+
+	"""searches for a key with bisect over the sorted keys
+
+	@type key: int
+	@param key: a key to be searched
+	@rtype: (Item,int)
+	@returns: a tuple (x,e) where x is the (key, value) Item of the key, or None if not found,
+	and e is the number of keys a binary search probes
+	@complexity: O(log n)
+	"""
+	def search(self, key):
+		i = bisect_left(self.keys_array, key)
+		e = self.treeSize.bit_length()
+		if i < self.treeSize and self.keys_array[i] == key:
+			return Item(self.keys_array[i], self.values_list[i]), e
+		return None, e
+
+
+	"""searches for a batch of keys at once
+
+	with numpy and numeric keys every level of the Eytzinger layout is one vectorized step for the
+	whole batch, otherwise the keys are searched one by one.
+
+	@type keys: iterable
+	@param keys: the keys to search
+	@rtype: list
+	@returns: the sorted index of every key (usable with select), -1 for a missing key - as a numpy
+	array when numpy is used
+	@complexity: O(m log n) for m keys
+	"""
+	def search_many(self, keys):
+		if self.layout is not None:
+			queries = numpy.asarray(keys)
+			if queries.ndim == 1 and queries.dtype.kind in 'iuf':
+				return self.search_many_vectorized(queries)
+
+		sorted_keys = self.keys_array
+		n = self.treeSize
+		found = []
+		for key in keys:
+			i = bisect_left(sorted_keys, key)
+			found.append(i if i < n and sorted_keys[i] == key else -1)
+		return found
+
+
+	"""the numpy version of search_many
+
+	each query walks down all the levels (branch free), then the trailing right turns are undone to
+	get the lower bound slot, which holds the key if the key is present.
+
+	@type queries: numpy.ndarray
+	@param queries: numeric keys
+	@rtype: numpy.ndarray
+	@complexity: O(m log n) for m keys, in O(log n) numpy operations
+	"""
+	def search_many_vectorized(self, queries):
+		layout = self.layout
+		n = self.treeSize
+		depth = n.bit_length()
+
+		k = numpy.ones(queries.shape, dtype=numpy.int64)
+		for _ in range(depth):
+			step = 2 * k + (layout[numpy.minimum(k, n)] < queries)
+			k = numpy.where(k <= n, step, k)
+
+		# shift out the trailing ones (right turns) and the left turn above them
+		done = numpy.zeros(queries.shape, dtype=bool)
+		for _ in range(depth + 2):
+			bit = k & 1
+			k = numpy.where(done, k, k >> 1)
+			done |= bit == 0
+
+		hit = (k > 0) & (layout[k] == queries)
+		return numpy.where(hit, self.layout_rank[k], -1)
+
+
+	"""converts the view back into a mutable dictionary
+
+	@rtype: AVLTree
+	@returns: a perfectly height-balanced tree holding the items
+	@complexity: O(n)
+	"""
+	def thaw(self):
+		return AVLTree.from_sorted(self.items(), self.treeSize)
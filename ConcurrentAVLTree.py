@@ -0,0 +1,367 @@
+"""A thread-safe wrapper around an AVL tree"""
+
+import threading
+import time
+
+from AVLTree import AVLTree
+
+
+"""
+A readers-writer lock - any number of readers or a single writer.
+Waiting writers block new readers, so a steady stream of searches cannot starve the writers.
+"""
+
+class RWLock(object):
+
+	"""
+	Constructor.
+	@complexity: O(1) worst case
+	"""
+	def __init__(self):
+		self.cond = threading.Condition(threading.Lock())
+		self.readers = 0
+		self.writer = False
+		self.waiting_writers = 0
+
+
+	"""blocks until the lock can be shared with other readers
+
+	@rtype: float
+	@returns: the number of seconds spent waiting
+	"""
+	def acquire_read(self):
+		start = time.perf_counter()
+		with self.cond:
+			while self.writer or self.waiting_writers:
+				self.cond.wait()
+			self.readers += 1
+		return time.perf_counter() - start
+
+
+	"""releases a lock taken with acquire_read"""
+	def release_read(self):
+		with self.cond:
+			self.readers -= 1
+			if self.readers == 0:
+				self.cond.notify_all()
+
+
+	"""blocks until the lock is held exclusively
+
+	@rtype: float
+	@returns: the number of seconds spent waiting
+	"""
+	def acquire_write(self):
+		start = time.perf_counter()
+		with self.cond:
+			self.waiting_writers += 1
+			while self.writer or self.readers:
+				self.cond.wait()
+			self.waiting_writers -= 1
+			self.writer = True
+		return time.perf_counter() - start
+
+
+	"""releases a lock taken with acquire_write"""
+	def release_write(self):
+		with self.cond:
+			self.writer = False
+			self.cond.notify_all()
+
+
+"""
+A pending write, waited on by the thread that submitted it.
+"""
+
+class WriteRequest(object):
+	__slots__ = ('kind', 'key', 'value', 'done', 'error', 'submitted')
+
+	"""
+	Constructor.
+
+	@type kind: string
+	@param kind: 'insert' or 'delete'
+	@complexity: O(1) worst case
+	"""
+	def __init__(self, kind, key, value):
+		self.kind = kind
+		self.key = key
+		self.value = value
+		self.done = threading.Event()
+		self.error = None
+		self.submitted = time.perf_counter()
+
+
+"""
+A thread-safe AVL tree.
+
+searches run in parallel under the read side of an RWLock. writes are queued, and whichever writer
+finds no batch in progress becomes the leader: it takes the write lock once and applies every queued
+write (its own and the ones that arrive meanwhile) as a group commit, then wakes their threads.
+"""
+
+class ConcurrentAVLTree(object):
+	# runs of at least this many consecutive inserts (deletes) of a batch go through insert_many (delete_many)
+	BULK_THRESHOLD = 16
+
+	"""
+	Constructor.
+
+	@type tree: AVLTree
+	@param tree: the tree to wrap, a new empty tree if None. it must not be used directly afterwards
+	@type max_batch: int
+	@param max_batch: the maximal number of writes applied under one lock acquisition
+	@complexity: O(1) worst case
+	"""
+	def __init__(self, tree=None, max_batch=4096):
+		self.tree = tree if tree is not None else AVLTree()
+		self.max_batch = max_batch
+		self.lock = RWLock()
+		self.queue_lock = threading.Lock()
+		self.queue = []
+		self.leader_active = False
+		self.stats_lock = threading.Lock()
+		self.reset_stats()
+
+
+	"""searches for a key
+
+	@type key: int
+	@param key: a key to be searched
+	@rtype: (AVLNode,int)
+	@returns: a tuple (x,e) as in AVLTree.search. x may be changed by later writes, use get to read the value atomically
+	@complexity: O(log n)
+	"""
+	def search(self, key):
+		waited = self.lock.acquire_read()
+		try:
+			return self.tree.search(key)
+		finally:
+			self.lock.release_read()
+			self.record_read(waited)
+
+
+	"""returns the value of a key
+
+	@type key: int
+	@param key: a key to be searched
+	@param default: returned when key is not in the dictionary
+	@complexity: O(log n)
+	"""
+	def get(self, key, default=None):
+		waited = self.lock.acquire_read()
+		try:
+			node, _ = self.tree.search(key)
+			return node.value if node is not None else default
+		finally:
+			self.lock.release_read()
+			self.record_read(waited)
+
+
+	"""returns the number of items in the dictionary
+
+	@rtype: int
+	@complexity: O(1)
+	"""
+	def size(self):
+		waited = self.lock.acquire_read()
+		try:
+			return self.tree.size()
+		finally:
+			self.lock.release_read()
+			self.record_read(waited)
+
+
+	"""returns the number of items in the dictionary
+
+	@rtype: int
+	@complexity: O(1)
+	"""
+	def __len__(self):
+		return self.size()
+
+
+	"""returns a consistent sorted list of the (key, value) pairs with lo <= key < hi
+
+	@rtype: list
+	@complexity: O(log n + k)
+	"""
+	def range_items(self, lo, hi):
+		waited = self.lock.acquire_read()
+		try:
+			return list(self.tree.range_items(lo, hi))
+		finally:
+			self.lock.release_read()
+			self.record_read(waited)
+
+
+	"""returns a consistent sorted list of all the (key, value) pairs
+
+	@rtype: list
+	@complexity: O(n)
+	"""
+	def avl_to_array(self):
+		waited = self.lock.acquire_read()
+		try:
+			return self.tree.avl_to_array()
+		finally:
+			self.lock.release_read()
+			self.record_read(waited)
+
+
+	"""inserts a key, or replaces its value if it is already in the dictionary.
+	returns once the write is applied.
+
+	@type key: int
+	@param key: key of item that is to be inserted
+	@type val: string
+	@param val: the value of the item
+	@complexity: O(log n) amortized over the group commit
+	"""
+	def insert(self, key, val):
+		self.submit(WriteRequest('insert', key, val))
+
+
+	"""deletes a key if it is in the dictionary. returns once the write is applied.
+
+	@type key: int
+	@param key: the key to delete
+	@complexity: O(log n) amortized over the group commit
+	"""
+	def delete(self, key):
+		self.submit(WriteRequest('delete', key, None))
+
+
+	"""queues a write and waits until a leader (possibly this thread) has applied it
+
+	@type request: WriteRequest
+	@param request: the write to apply
+	"""
+	def submit(self, request):
+		with self.queue_lock:
+			self.queue.append(request)
+			lead = not self.leader_active
+			if lead:
+				self.leader_active = True
+
+		if lead:
+			self.lead()
+		request.done.wait()
+		if request.error is not None:
+			raise request.error
+
+
+	"""applies queued writes in batches until the queue is empty, then gives up leadership"""
+	def lead(self):
+		while True:
+			with self.queue_lock:
+				if not self.queue:
+					self.leader_active = False
+					return
+				batch = self.queue[:self.max_batch]
+				del self.queue[:self.max_batch]
+
+			waited = self.lock.acquire_write()
+			try:
+				self.apply_batch(batch)
+			finally:
+				self.lock.release_write()
+
+			now = time.perf_counter()
+			with self.stats_lock:
+				self.write_lock_wait += waited
+				self.batches += 1
+				self.writes += len(batch)
+				self.max_batch_size = max(self.max_batch_size, len(batch))
+				for request in batch:
+					self.write_latency += now - request.submitted
+			for request in batch:
+				request.done.set()
+
+
+	"""applies a batch of writes in order, coalescing long runs of the same kind of write
+
+	every write that fails gets its own error and the others are still applied. if the bulk call of
+	a long run raises, the run is applied again one write at a time to find the failing writes -
+	upserts and deletes can be repeated safely.
+
+	@type batch: list
+	@param batch: WriteRequests in submission order
+	"""
+	def apply_batch(self, batch):
+		i = 0
+		while i < len(batch):
+			j = i
+			while j < len(batch) and batch[j].kind == batch[i].kind:
+				j += 1
+			run = batch[i:j]
+			i = j
+
+			if len(run) >= self.BULK_THRESHOLD:
+				try:
+					if run[0].kind == 'insert':
+						self.tree.insert_many((request.key, request.value) for request in run)
+					else:
+						self.tree.delete_many(request.key for request in run)
+					continue
+				except Exception:
+					pass
+
+			for request in run:
+				try:
+					self.apply_one(request)
+				except Exception as error:
+					request.error = error
+
+
+	"""applies a single write
+
+	@type request: WriteRequest
+	@param request: the write to apply
+	"""
+	def apply_one(self, request):
+		if request.kind == 'insert':
+			self.tree.upsert(request.key, request.value)
+		else:
+			self.tree.delete_key(request.key)
+
+
+	"""records a finished read"""
+	def record_read(self, waited):
+		with self.stats_lock:
+			self.reads += 1
+			self.read_lock_wait += waited
+			self.max_read_lock_wait = max(self.max_read_lock_wait, waited)
+
+
+	"""clears the lock and batching metrics"""
+	def reset_stats(self):
+		with self.stats_lock:
+			self.reads = 0
+			self.read_lock_wait = 0.0
+			self.max_read_lock_wait = 0.0
+			self.writes = 0
+			self.batches = 0
+			self.max_batch_size = 0
+			self.write_lock_wait = 0.0
+			self.write_latency = 0.0
+
+
+	"""returns the lock wait time and batch size metrics
+
+	@rtype: dict
+	@returns: counts and times (in seconds) of reads, writes and group commits since the last reset_stats
+	"""
+	def stats(self):
+		with self.stats_lock:
+			return {
+				'reads': self.reads,
+				'read_lock_wait': self.read_lock_wait,
+				'max_read_lock_wait': self.max_read_lock_wait,
+				'writes': self.writes,
+				'batches': self.batches,
+				'avg_batch_size': self.writes / float(self.batches) if self.batches else 0.0,
+				'max_batch_size': self.max_batch_size,
+				'write_lock_wait': self.write_lock_wait,
+				'avg_write_latency': self.write_latency / self.writes if self.writes else 0.0,
+			}
@@ -0,0 +1,147 @@
+"""An AVL tree of intervals keyed by their start"""
+
+from AVLTree import AVLNode, AVLTree
+
+
+"""
+A node of an IntervalAVLTree - an AVLNode with the end of its interval and the maximal end
+in its subtree.
+"""
+
+class IntervalNode(AVLNode):
+	__slots__ = ('end', 'max_end')
+
+	"""Constructor.
+
+	@type key: int
+	@param key: the start of the interval
+	@param value: data of the node
+	@complexity: O(1) worst case
+	"""
+	def __init__(self, key, value):
+		AVLNode.__init__(self, key, value)
+		self.end = key  # a point interval until the tree sets the end
+		self.max_end = key
+
+
+"""
+An AVL tree of closed intervals [start, end], keyed by start (starts are unique).
+
+every node also keeps the maximal end in its subtree. it is derived from the children like the
+subtree size, so AVLTree keeps it up to date wherever it calls refresh - insertions, deletions,
+rotations, join and split. items added through the plain AVLTree methods (insert, insert_many,
+from_sorted...) are point intervals [key, key].
+"""
+
+class IntervalAVLTree(AVLTree):
+	node_class = IntervalNode
+
+	"""creates a new real leaf of the point interval [key, key], see AVLTree.new_node
+
+	@rtype: IntervalNode
+	@complexity: O(1)
+	"""
+	def new_node(self, key, val):
+		node = AVLTree.new_node(self, key, val)
+		node.end = key  # a pooled node still holds the interval it had
+		node.max_end = key
+		return node
+
+
+	"""recomputes the fields of AVLTree.refresh and the maximal end of a node from its children
+
+	@type node: IntervalNode
+	@param node: a real node whose children are up to date
+	@complexity: O(1)
+	"""
+	def refresh(self, node):
+		AVLTree.refresh(self, node)
+		left = node.left
+		right = node.right
+
+		max_end = node.end
+		if left.key is not None and left.max_end > max_end:
+			max_end = left.max_end
+		if right.key is not None and right.max_end > max_end:
+			max_end = right.max_end
+		node.max_end = max_end
+
+
+	"""adds the interval [start, end], or replaces the end and value of the interval starting at start
+
+	@type start: int
+	@param start: the start of the interval, the key
+	@type end: int
+	@param end: the end of the interval, at least start
+	@param val: the value of the interval
+	@rtype: IntervalNode
+	@returns: the node of the interval
+	@complexity: O(log n)
+	"""
+	def insert_interval(self, start, end, val):
+		if end < start:
+			raise ValueError("interval end %r is smaller than its start %r" % (end, start))
+
+		node, parent = self.search_or_parent(start)
+		if node is not None:
+			node = self.own(node)
+			node.value = val
+			node.end = end
+			self.refresh_path(node)
+			return node
+
+		node = self.new_node(start, val)
+		node.end = end
+		node.max_end = end
+		if parent is None:
+			self.set_root(node)
+		else:
+			self.link_leaf(node, parent)
+			self.treeSize += 1
+		return node
+
+
+	"""lazily iterates over the nodes whose interval overlaps [lo, hi], in increasing start order
+
+	a subtree is skipped when its maximal end is smaller than lo, and the walk stops at the first
+	start larger than hi.
+
+	@type lo: int
+	@param lo: the start of the query window
+	@type hi: int
+	@param hi: the end of the query window (inclusive)
+	@rtype: generator
+	@returns: a generator of IntervalNode, the dictionary must not be modified while it is consumed
+	@complexity: O(log n) per reported interval, O(log n + k) when the k overlapping intervals
+	are close together in start order
+	"""
+	def overlapping(self, lo, hi):
+		stack = []
+		node = self.root
+		while node is not None and node.key is not None and not node.max_end < lo:
+			stack.append(node)
+			node = node.left
+
+		while stack:
+			node = stack.pop()
+			if hi < node.key:
+				return
+			if not node.end < lo:
+				yield node
+
+			node = node.right
+			while node.key is not None and not node.max_end < lo:
+				stack.append(node)
+				node = node.left
+
+
+	"""lazily iterates over the nodes whose interval contains a point
+
+	@type point: int
+	@param point: the point to stab the intervals with
+	@rtype: generator
+	@returns: a generator of IntervalNode, in increasing start order
+	@complexity: as overlapping
+	"""
+	def stab(self, point):
+		return self.overlapping(point, point)
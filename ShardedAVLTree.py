@@ -0,0 +1,451 @@
+"""An AVL tree range-partitioned across worker processes"""
+
+import multiprocessing
+import os
+from bisect import bisect_right
+
+from AVLTree import AVLTree
+
+
+"""
+The part of a ShardedAVLTree owned by one worker process. the worker calls these methods
+on behalf of the ShardedAVLTree, so arguments and results are plain keys, values and lists.
+"""
+
+class ShardWorker(object):
+
+	"""
+	Constructor.
+	@complexity: O(1) worst case
+	"""
+	def __init__(self):
+		self.tree = AVLTree()
+
+
+	"""inserts a key, or replaces its value if it is already in the shard
+
+	@rtype: bool
+	@returns: True if the key is new
+	@complexity: O(log n)
+	"""
+	def insert(self, key, val):
+		return self.tree.upsert(key, val)[1]
+
+
+	"""returns the value of a key, default if it is not in the shard
+
+	@complexity: O(log n)
+	"""
+	def get(self, key, default):
+		node, _ = self.tree.search(key)
+		return node.value if node is not None else default
+
+
+	"""deletes a key if it is in the shard
+
+	@rtype: bool
+	@returns: True if the key was deleted
+	@complexity: O(log n)
+	"""
+	def delete(self, key):
+		return self.tree.delete_key(key) is not None
+
+
+	"""inserts a batch of items, see AVLTree.insert_many
+
+	@rtype: int
+	@returns: the number of new keys
+	@complexity: O(m log(n/m + 1))
+	"""
+	def insert_many(self, items):
+		return self.tree.insert_many(items)[0]
+
+
+	"""deletes a batch of keys, see AVLTree.delete_many
+
+	@rtype: int
+	@returns: the number of deleted keys
+	@complexity: O(m log(n/m + 1))
+	"""
+	def delete_many(self, keys):
+		return self.tree.delete_many(keys)[0]
+
+
+	"""returns the sorted list of the (key, value) pairs with lo <= key < hi
+
+	@complexity: O(log n + k)
+	"""
+	def range_items(self, lo, hi):
+		return list(self.tree.range_items(lo, hi))
+
+
+	"""returns the sorted list of all the (key, value) pairs
+
+	@complexity: O(n)
+	"""
+	def items(self):
+		return self.tree.avl_to_array()
+
+
+	"""returns the number of keys in the shard
+
+	@complexity: O(1)
+	"""
+	def size(self):
+		return self.tree.size()
+
+
+	"""returns the k-th smallest key of the shard (counting from 0)
+
+	@complexity: O(log n)
+	"""
+	def key_at(self, k):
+		return self.tree.select(k).key
+
+
+	"""removes the keys on one side of a split key with AVLTree.split_key
+
+	@type key: int
+	@param key: the split key
+	@type upper: bool
+	@param upper: True to remove the keys >= key, False to remove the keys < key
+	@rtype: list
+	@returns: the removed (key, value) pairs, sorted
+	@complexity: O(log n + k)
+	"""
+	def split_off(self, key, upper):
+		left, right = self.tree.split_key(key)
+		self.tree, removed = (left, right) if upper else (right, left)
+		return removed.avl_to_array()
+
+
+	"""adds keys that all lie on one side of the shard's keys with join2_nodes
+
+	@type items: list
+	@param items: sorted (key, value) pairs
+	@type upper: bool
+	@param upper: True if the items are larger than every key of the shard, False if smaller
+	@complexity: O(k + log n)
+	"""
+	def join_in(self, items, upper):
+		if not items:
+			return
+		tree = self.tree
+		moved = AVLTree.from_sorted(items)
+		mine = tree.root if tree.root is not None else tree.ext_leaf
+		if upper:
+			root, _ = tree.join2_nodes(mine, moved.root)
+		else:
+			root, _ = tree.join2_nodes(moved.root, mine)
+		tree.set_root(root)
+
+
+"""runs a ShardWorker, answering the requests that arrive on a pipe until 'close'
+
+@type conn: multiprocessing.connection.Connection
+@param conn: the worker's end of the pipe. requests are (method, args), replies are
+(True, result) or (False, exception)
+"""
+def serve(conn):
+	worker = ShardWorker()
+	while True:
+		method, args = conn.recv()
+		if method == 'close':
+			conn.close()
+			return
+		try:
+			conn.send((True, getattr(worker, method)(*args)))
+		except Exception as error:
+			conn.send((False, error))
+
+
+"""
+A dictionary whose key space is range-partitioned across worker processes, each owning an AVLTree.
+
+shard i holds the keys k with boundaries[i-1] <= k < boundaries[i]. point operations are routed to
+one shard, batches and scans are sent to every shard involved first and collected afterwards, so the
+shards work on them in parallel. rebalance() moves key ranges between neighbouring shards.
+"""
+
+class ShardedAVLTree(object):
+
+	"""
+	Constructor, starts one worker process per shard.
+
+	@type boundaries: list
+	@param boundaries: strictly increasing split keys, len(boundaries) + 1 shards are created
+	@type context: multiprocessing context
+	@param context: the context the workers are started with, the default context if None
+	@complexity: O(number of shards)
+	"""
+	def __init__(self, boundaries, context=None):
+		if any(not a < b for a, b in zip(boundaries, boundaries[1:])):
+			raise ValueError("boundaries must be strictly increasing")
+
+		context = context or multiprocessing.get_context()
+		self.boundaries = list(boundaries)
+		self.conns = []
+		self.processes = []
+		for _ in range(len(self.boundaries) + 1):
+			parent_conn, child_conn = context.Pipe()
+			process = context.Process(target=serve, args=(child_conn,), daemon=True)
+			process.start()
+			child_conn.close()
+			self.conns.append(parent_conn)
+			self.processes.append(process)
+
+
+	"""builds a sharded dictionary whose boundaries split the items into equal parts
+
+	@type items: iterable
+	@param items: (key, value) pairs in any order
+	@type shards: int
+	@param shards: the number of worker processes, one per CPU if None
+	@rtype: ShardedAVLTree
+	@complexity: O(n log n) for the sort, the shards are built in parallel
+	"""
+	@classmethod
+	def from_items(cls, items, shards=None, context=None):
+		pairs = sorted(dict(items).items(), key=lambda item: item[0])
+		shards = shards or os.cpu_count() or 1
+		boundaries = []
+		for i in range(1, shards):
+			key = pairs[i * len(pairs) // shards][0] if pairs else None
+			if key is not None and (not boundaries or boundaries[-1] < key):
+				boundaries.append(key)
+
+		sharded = cls(boundaries, context)
+		sharded.insert_many(pairs)
+		return sharded
+
+
+	"""returns the index of the shard that owns a key
+
+	@rtype: int
+	@complexity: O(log s) for s shards
+	"""
+	def shard_of(self, key):
+		return bisect_right(self.boundaries, key)
+
+
+	"""calls a ShardWorker method on one shard and waits for the result
+
+	@type i: int
+	@param i: the shard index
+	@type method: string
+	@param method: the name of the ShardWorker method
+	"""
+	def call(self, i, method, *args):
+		self.conns[i].send((method, args))
+		return self.receive(i)
+
+
+	"""calls a ShardWorker method on several shards in parallel
+
+	@type calls: list
+	@param calls: (shard index, method, args) triples
+	@rtype: list
+	@returns: the results in the order of calls
+	"""
+	def call_many(self, calls):
+		for i, method, args in calls:
+			self.conns[i].send((method, args))
+		return [self.receive(i) for i, _, _ in calls]
+
+
+	"""receives the reply of a shard, raising the exception it sent
+
+	@type i: int
+	@param i: the shard index
+	"""
+	def receive(self, i):
+		ok, result = self.conns[i].recv()
+		if not ok:
+			raise result
+		return result
+
+
+	"""inserts a key, or replaces its value if it is already in the dictionary
+
+	@type key: int
+	@param key: key of item that is to be inserted
+	@param val: the value of the item
+	@rtype: bool
+	@returns: True if the key is new
+	@complexity: O(log n) in the owning shard
+	"""
+	def insert(self, key, val):
+		return self.call(self.shard_of(key), 'insert', key, val)
+
+
+	"""returns the value of a key
+
+	@type key: int
+	@param key: a key to be searched
+	@param default: returned when key is not in the dictionary
+	@complexity: O(log n) in the owning shard
+	"""
+	def get(self, key, default=None):
+		return self.call(self.shard_of(key), 'get', key, default)
+
+
+	"""deletes a key if it is in the dictionary
+
+	@type key: int
+	@param key: the key to delete
+	@rtype: bool
+	@returns: True if the key was deleted
+	@complexity: O(log n) in the owning shard
+	"""
+	def delete(self, key):
+		return self.call(self.shard_of(key), 'delete', key)
+
+
+	"""inserts a batch of items, each shard inserting its part in parallel
+
+	@type items: iterable
+	@param items: (key, value) pairs in any order
+	@rtype: int
+	@returns: the number of new keys
+	@complexity: O(m) to partition, then O(m/s log(n/m + 1)) per shard for s shards
+	"""
+	def insert_many(self, items):
+		parts = [[] for _ in self.conns]
+		for item in items:
+			parts[self.shard_of(item[0])].append(item)
+		return sum(self.call_many([(i, 'insert_many', (part,)) for i, part in enumerate(parts) if part]))
+
+
+	"""deletes a batch of keys, each shard deleting its part in parallel
+
+	@type keys: iterable
+	@param keys: keys to delete, keys that do not appear are ignored
+	@rtype: int
+	@returns: the number of deleted keys
+	"""
+	def delete_many(self, keys):
+		parts = [[] for _ in self.conns]
+		for key in keys:
+			parts[self.shard_of(key)].append(key)
+		return sum(self.call_many([(i, 'delete_many', (part,)) for i, part in enumerate(parts) if part]))
+
+
+	"""returns the sorted list of the (key, value) pairs with lo <= key < hi, scanning the shards in parallel
+
+	@rtype: list
+	@complexity: O(log n + k)
+	"""
+	def range_items(self, lo, hi):
+		if not lo < hi:
+			return []
+		first, last = self.shard_of(lo), self.shard_of(hi)
+		parts = self.call_many([(i, 'range_items', (lo, hi)) for i in range(first, last + 1)])
+		return [item for part in parts for item in part]
+
+
+	"""returns the sorted list of all the (key, value) pairs
+
+	@rtype: list
+	@complexity: O(n)
+	"""
+	def avl_to_array(self):
+		parts = self.call_many([(i, 'items', ()) for i in range(len(self.conns))])
+		return [item for part in parts for item in part]
+
+
+	"""returns the number of keys in every shard
+
+	@rtype: list
+	@complexity: O(s) for s shards
+	"""
+	def shard_sizes(self):
+		return self.call_many([(i, 'size', ()) for i in range(len(self.conns))])
+
+
+	"""returns the number of items in the dictionary
+
+	@rtype: int
+	@complexity: O(s) for s shards
+	"""
+	def size(self):
+		return sum(self.shard_sizes())
+
+
+	"""returns the number of items in the dictionary
+
+	@rtype: int
+	@complexity: O(s) for s shards
+	"""
+	def __len__(self):
+		return self.size()
+
+
+	"""evens out the shard sizes by moving key ranges between the shards
+
+	the new boundary i is the key of global rank (i + 1) * n // s, found from the shard sizes. every
+	shard then splits off its keys below and above its new range, and the coordinator hands each
+	removed range to the shards that own it now, which join it in at their low or high end. keys
+	move directly to their final shard in whichever direction, and only the moved items are copied
+	between the processes.
+
+	@rtype: int
+	@returns: the number of moved items
+	@complexity: O(s log n + moved items) for s shards
+	"""
+	def rebalance(self):
+		sizes = self.shard_sizes()
+		total = sum(sizes)
+		shards = len(sizes)
+		if total < shards:
+			return 0  # some shard would have to stay empty, with no key for its boundary
+
+		# the key of global rank r is in the shard j with starts[j] <= r < starts[j + 1]
+		starts = [0]
+		for size in sizes:
+			starts.append(starts[-1] + size)
+		calls = []
+		for i in range(shards - 1):
+			rank = (i + 1) * total // shards
+			j = bisect_right(starts, rank) - 1
+			calls.append((j, 'key_at', (rank - starts[j],)))
+		boundaries = self.call_many(calls)
+
+		# the keys below and above the new range of every shard
+		below = self.call_many([(j, 'split_off', (boundaries[j - 1], False)) for j in range(1, shards)])
+		above = self.call_many([(j, 'split_off', (boundaries[j], True)) for j in range(shards - 1)])
+		self.boundaries = boundaries
+
+		# a range from a shard on the right is larger than the keys a shard kept, one from the left smaller.
+		# collected in shard order, both lists of every shard stay sorted
+		larger = [[] for _ in sizes]
+		smaller = [[] for _ in sizes]
+		for part in below:
+			for item in part:
+				larger[self.shard_of(item[0])].append(item)
+		for part in above:
+			for item in part:
+				smaller[self.shard_of(item[0])].append(item)
+
+		calls = [(i, 'join_in', (items, False)) for i, items in enumerate(smaller) if items]
+		calls += [(i, 'join_in', (items, True)) for i, items in enumerate(larger) if items]
+		self.call_many(calls)
+		return sum(len(part) for part in below) + sum(len(part) for part in above)
+
+
+	"""stops the worker processes, the dictionary cannot be used afterwards"""
+	def close(self):
+		for conn in self.conns:
+			conn.send(('close', ()))
+			conn.close()
+		for process in self.processes:
+			process.join()
+		self.conns = []
+		self.processes = []
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, *exc_info):
+		self.close()
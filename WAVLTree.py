@@ -0,0 +1,162 @@
+"""A weak AVL (rank-balanced) tree"""
+
+from AVLTree import AVLTree
+
+
+"""
+A weak AVL tree - an AVLTree with the rank-balanced rules of Haeupler, Sen and Tarjan.
+
+the height field holds the rank. every rank difference is 1 or 2 (so (2,2) nodes are allowed)
+and every leaf has rank 0. without deletions the tree is exactly an AVL tree. deletions only
+demote nodes until at most two rotations finish the rebalancing, and the number of rotations is
+O(1) amortized over any sequence of insertions and deletions. joins, splits and the bulk
+operations of AVLTree keep the rank rules as they are.
+"""
+
+class WAVLTree(AVLTree):
+
+	"""rebalance after insertion i.e promotions and at most one single or double rotation
+
+	@type node: AVLNode
+	@param node: the leaf that was just promoted by link_leaf
+	@rtype: int
+	@returns: the number of PROMOTE cases
+	@complexity: O(log n) worst case, O(1) amortized
+	"""
+	def insert_rebalance(self, node):
+		promote_counter = 0
+		curr = node.parent
+
+		while curr is not None:
+			curr_bf = curr.balance_factor_detailed()
+
+			# case 1: (0,1) junction
+			if curr_bf in (1, 10):
+				self.promote(curr)
+				promote_counter += 1
+				curr = curr.parent
+				continue
+
+			# case 2.1: (0,2) junction - the child is (1,2) or (2,1)
+			if curr_bf == 2:
+				if curr.left.balance_factor_detailed() == 21:
+					self.left_rotation(curr.left)
+					kind = 'double_left_right'
+				else:
+					kind = 'single_right'
+				self.right_rotation(curr)
+
+			# case 2.2: (2,0) junction *SYMETRIC TO CASE 2.1*
+			elif curr_bf == 20:
+				if curr.right.balance_factor_detailed() == 12:
+					self.right_rotation(curr.right)
+					kind = 'double_right_left'
+				else:
+					kind = 'single_left'
+				self.left_rotation(curr)
+
+			# the rank of curr did not change
+			else:
+				break
+
+			if self.counters is not None:
+				self.counters.rotations[kind] += 1
+			break
+
+		return promote_counter
+
+
+	"""rebalances and refreshes the sizes after a deletion, walking up from the lowest changed node
+
+	the walk demotes (2,2) leaves, (3,2) and (2,3) nodes, and (3,1) nodes whose other child is (2,2)
+	together with that child. any other (3,1) or (1,3) node is fixed by a single or double rotation
+	that ends the walk. the rotations set the ranks themselves - the rank of a node is not always
+	one more than the larger rank of its children.
+
+	@type node: AVLNode
+	@pararm node: the node we start rebalancing from, None if the dictionary became empty
+	@rtype: int
+	@returns: the number of iterations of the rebalancing loop
+	@complexity: O(log n), at most two rotations
+	"""
+	def delete_rebalance(self, node):
+		iterations = 0
+		curr = node
+
+		while curr is not None:
+			iterations += 1
+			self.refresh(curr)
+			curr_bf = curr.balance_factor_detailed()
+
+			# the rank of curr drops, continue at the parent
+			if curr_bf in (23, 32) or (curr_bf == 22 and not curr.left.is_real_node() and not curr.right.is_real_node()):
+				self.demote(curr)
+
+			# (3,1)
+			elif curr_bf == 31:
+				right_node_bf = curr.right.balance_factor_detailed()
+
+				# (2,2) sibling - both ranks drop
+				if right_node_bf == 22:
+					self.demote(curr)
+					self.demote(self.own(curr.right))
+
+				else:
+					rank = curr.height
+					if right_node_bf == 12:
+						self.right_rotation(curr.right)
+						self.left_rotation(curr)
+						kind = 'double_right_left'
+						top = curr.parent
+						top.right.height = rank - 2
+						curr.height = rank - 2
+					else:
+						self.left_rotation(curr)
+						kind = 'single_left'
+						top = curr.parent
+						curr.height = rank - 1 if curr.left.is_real_node() or curr.right.is_real_node() else 0
+					top.height = rank
+
+					if self.counters is not None:
+						self.counters.rotations[kind] += 1
+					curr = top  # the subtree kept its rank
+					break
+
+			# (1,3) *SYMMETRIC TO (3,1)*
+			elif curr_bf == 13:
+				left_node_bf = curr.left.balance_factor_detailed()
+
+				if left_node_bf == 22:
+					self.demote(curr)
+					self.demote(self.own(curr.left))
+
+				else:
+					rank = curr.height
+					if left_node_bf == 21:
+						self.left_rotation(curr.left)
+						self.right_rotation(curr)
+						kind = 'double_left_right'
+						top = curr.parent
+						top.left.height = rank - 2
+						curr.height = rank - 2
+					else:
+						self.right_rotation(curr)
+						kind = 'single_right'
+						top = curr.parent
+						curr.height = rank - 1 if curr.left.is_real_node() or curr.right.is_real_node() else 0
+					top.height = rank
+
+					if self.counters is not None:
+						self.counters.rotations[kind] += 1
+					curr = top
+					break
+
+			# every rank difference of curr is 1 or 2 - its rank did not change
+			else:
+				break
+
+			curr = curr.parent
+
+		if curr is not None:
+			self.refresh_path(curr.parent)
+		return iterations
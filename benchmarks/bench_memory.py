@@ -0,0 +1,93 @@
+"""Memory benchmark - bytes per key of an AVLTree
+
+Compares the current AVLNode layout against the original dict-backed layout
+by building the same tree twice and measuring the traced allocations.
+
+usage: python benchmarks/bench_memory.py [-n 100000] [-n 1000000] [--json]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import AVLTree as avl
+
+
+class DictAVLNode(object):
+	"""the original AVLNode layout, every instance carries a __dict__"""
+	def __init__(self, key, value):
+		self.key = key
+		self.value = value
+		self.left = None
+		self.right = None
+		self.parent = None
+		self.height = -1
+		self.size = 0
+		self.epoch = 0
+		self.agg = None
+		self.generation = 0
+
+	is_real_node = avl.AVLNode.is_real_node
+	is_real_leaf = avl.AVLNode.is_real_leaf
+	balance_factor = avl.AVLNode.balance_factor
+	balance_factor_detailed = avl.AVLNode.balance_factor_detailed
+	num_of_real_children = avl.AVLNode.num_of_real_children
+
+
+"""builds a tree of n keys with the given node class and measures it
+
+@type n: int
+@param n: number of keys to insert
+@type node_cls: type
+@param node_cls: the node class the tree allocates
+@rtype: dict
+@returns: the traced bytes of the tree and the bytes per key
+"""
+def measure(n, node_cls):
+	keys = list(range(n))
+	random.Random(n).shuffle(keys)
+	original = avl.AVLTree.node_class
+	avl.AVLTree.node_class = node_cls
+	try:
+		tracemalloc.start()
+		before = tracemalloc.get_traced_memory()[0]
+		tree = avl.AVLTree()
+		for key in keys:
+			# keys and values are shared with the list above, only the nodes are measured
+			tree.insert(key, None)
+		after = tracemalloc.get_traced_memory()[0]
+		tracemalloc.stop()
+	finally:
+		avl.AVLTree.node_class = original
+
+	total = after - before
+	return {'layout': node_cls.__name__, 'n': n, 'bytes': total, 'bytes_per_key': total / float(n)}
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('-n', type=int, action='append', help='number of keys (repeatable)')
+	parser.add_argument('--json', action='store_true', help='print machine readable results')
+	args = parser.parse_args(argv)
+
+	results = []
+	for n in args.n or [10 ** 4, 10 ** 5]:
+		results.append(measure(n, DictAVLNode))
+		results.append(measure(n, avl.AVLNode))
+
+	if args.json:
+		print(json.dumps(results, indent=2))
+		return
+
+	print('%-12s %10s %14s %14s' % ('layout', 'n', 'bytes', 'bytes/key'))
+	for res in results:
+		print('%-12s %10d %14d %14.1f' % (res['layout'], res['n'], res['bytes'], res['bytes_per_key']))
+
+
+if __name__ == '__main__':
+	main()
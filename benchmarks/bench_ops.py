@@ -0,0 +1,343 @@
+"""Operation benchmark - throughput and latency percentiles of the AVLTree operations
+
+Runs insert, finger_insert, delete, search, finger_search, join, split and churn
+(a delete followed by an insert) over sequential, reverse, random and Zipf key orders,
+timing every call, on the AVL and weak AVL (WAVL) engines. Inserts also
+report the average search path length (e) and promotions (h) they return, searches
+the average path length, and inserts and deletes the average rotations counted by
+AVLTree.enable_stats. churn also reports the node allocations and the garbage collector
+pauses, with the node pool of AVLTree.enable_pool when --pool is given.
+
+usage: python benchmarks/bench_ops.py [-n 1000] [-n 10000000] [--dist random] [--op insert]
+                                      [--engine wavl] [--pool 1024] [--json] [--output results.json] [--baseline results.json]
+
+with --baseline, ops whose throughput dropped by more than --tolerance against the
+baseline file are listed and the exit status is 1.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from array import array
+from bisect import bisect_left
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from AVLTree import AVLTree
+from WAVLTree import WAVLTree
+
+
+DISTRIBUTIONS = ('sequential', 'reverse', 'random', 'zipf')
+OPERATIONS = ('insert', 'finger_insert', 'delete', 'search', 'finger_search', 'join', 'split', 'churn')
+ENGINES = {'avl': AVLTree, 'wavl': WAVLTree}
+ZIPF_EXPONENT = 1.1
+
+
+"""returns the keys 0..n-1 in the order a distribution produces them
+
+'zipf' is a weighted shuffle where the key of rank i has weight 1/(i+1)^s, so the small
+(hot) keys tend to come first.
+
+@type dist: string
+@param dist: one of DISTRIBUTIONS
+@rtype: list
+"""
+def key_order(dist, n, rng):
+	keys = list(range(n))
+	if dist == 'reverse':
+		keys.reverse()
+	elif dist == 'random':
+		rng.shuffle(keys)
+	elif dist == 'zipf':
+		# sampling without replacement: sort by u^(1/w), i.e. by log(u) / w
+		keys.sort(key=lambda i: -rng.expovariate(1.0) * (i + 1) ** ZIPF_EXPONENT, reverse=True)
+	return keys
+
+
+"""returns m query keys drawn from 0..n-1 following a distribution
+
+@type dist: string
+@param dist: one of DISTRIBUTIONS, 'zipf' draws with replacement
+@rtype: list
+"""
+def query_keys(dist, n, m, rng):
+	if dist == 'zipf':
+		cum_weights = list(itertools.accumulate(1.0 / (i + 1) ** ZIPF_EXPONENT for i in range(n)))
+		total = cum_weights[-1]
+		return [bisect_left(cum_weights, rng.random() * total) for _ in range(m)]
+
+	order = key_order(dist, n, rng)
+	return [order[i % n] for i in range(m)]
+
+
+"""summarizes the latencies of one benchmark
+
+@type latencies: array
+@param latencies: the duration of every timed call in seconds
+@rtype: dict
+"""
+def summarize(latencies):
+	ordered = sorted(latencies)
+	count = len(ordered)
+	total = sum(ordered)
+
+	def pct(p):
+		return ordered[min(count - 1, int(p * count / 100.0))] * 1e6
+
+	return {
+		'count': count,
+		'seconds': total,
+		'ops_per_sec': count / total if total else 0.0,
+		'p50_us': pct(50),
+		'p90_us': pct(90),
+		'p99_us': pct(99),
+		'p999_us': pct(99.9),
+		'max_us': ordered[-1] * 1e6,
+	}
+
+
+"""inserts the keys one by one with insert or finger_insert
+
+@rtype: dict
+@returns: the latency summary plus the average path length, promotions and rotations per insert
+"""
+def bench_insert(cls, n, dist, rng, finger):
+	tree = cls()
+	tree.enable_stats()
+	op = tree.finger_insert if finger else tree.insert
+	latencies = array('d')
+	edges = promotes = 0
+	clock = time.perf_counter
+
+	for key in key_order(dist, n, rng):
+		start = clock()
+		_, e, h = op(key, None)
+		latencies.append(clock() - start)
+		edges += e
+		promotes += h
+
+	res = summarize(latencies)
+	res['avg_path'] = edges / float(n)
+	res['avg_promotions'] = promotes / float(n)
+	res['avg_rotations'] = tree.stats()['rotations_total'] / float(n)
+	return res
+
+
+"""searches n keys of a balanced tree with search or finger_search
+
+@rtype: dict
+@returns: the latency summary plus the average path length per search
+"""
+def bench_search(cls, n, dist, rng, finger):
+	tree = cls.from_sorted(((key, None) for key in range(n)), n)
+	op = tree.finger_search if finger else tree.search
+	latencies = array('d')
+	edges = 0
+	clock = time.perf_counter
+
+	for key in query_keys(dist, n, n, rng):
+		start = clock()
+		_, e = op(key)
+		latencies.append(clock() - start)
+		edges += e
+
+	res = summarize(latencies)
+	res['avg_path'] = edges / float(n)
+	return res
+
+
+"""deletes every key of a balanced tree, only the delete calls are timed
+
+@rtype: dict
+@returns: the latency summary plus the average rotations per delete
+"""
+def bench_delete(cls, n, dist, rng):
+	tree = cls.from_sorted(((key, None) for key in range(n)), n)
+	latencies = array('d')
+	clock = time.perf_counter
+
+	order = key_order(dist, n, rng)
+	nodes = [tree.search(key)[0] for key in order]
+	tree.enable_stats()
+	for node in nodes:
+		start = clock()
+		tree.delete(node)
+		latencies.append(clock() - start)
+
+	res = summarize(latencies)
+	res['avg_rotations'] = tree.stats()['rotations_total'] / float(n)
+	return res
+
+
+"""splits a balanced tree at keys drawn from a distribution and joins the halves back
+
+@type trials: int
+@param trials: the number of split and join pairs
+@rtype: (dict, dict)
+@returns: the latency summaries of split and of join
+"""
+def bench_split_join(cls, n, dist, rng, trials):
+	tree = cls.from_sorted(((key, None) for key in range(n)), n)
+	split_latencies = array('d')
+	join_latencies = array('d')
+	clock = time.perf_counter
+
+	for key in query_keys(dist, n, trials, rng):
+		node, _ = tree.search(key)
+		start = clock()
+		left, right = tree.split(node)
+		split_latencies.append(clock() - start)
+
+		start = clock()
+		left.join(right, key, None)
+		join_latencies.append(clock() - start)
+		tree = left
+
+	return summarize(split_latencies), summarize(join_latencies)
+
+
+"""replaces keys of a balanced tree one by one - every timed call deletes a key and inserts a new one
+
+@type pool: int
+@param pool: the capacity of the node pool, 0 for none
+@rtype: dict
+@returns: the latency summary plus the allocations per call and the garbage collector pauses
+"""
+def bench_churn(cls, n, dist, rng, pool):
+	tree = cls.from_sorted(((key, None) for key in range(n)), n)
+	if pool:
+		tree.enable_pool(pool)
+	latencies = array('d')
+	clock = time.perf_counter
+
+	tree.enable_stats()
+	for i, key in enumerate(key_order(dist, n, rng)):
+		start = clock()
+		tree.delete_key(key)
+		tree.insert(n + i, None)
+		latencies.append(clock() - start)
+
+	stats = tree.stats()
+	tree.disable_stats()
+	res = summarize(latencies)
+	res['avg_allocations'] = stats['allocations'] / float(n)
+	res['gc_collections'] = stats['gc_collections']
+	res['gc_pause_max_us'] = stats['gc_pause_max'] * 1e6
+	return res
+
+
+"""runs the requested operations on one engine, size and distribution
+
+@type engine: string
+@param engine: one of ENGINES
+@rtype: list
+@returns: one result dict per operation
+"""
+def run(engine, n, dist, ops, seed, trials, pool=0):
+	cls = ENGINES[engine]
+	results = []
+
+	def record(op, res):
+		res.update({'op': op, 'engine': engine, 'dist': dist, 'n': n})
+		results.append(res)
+
+	for op in ops:
+		rng = random.Random(seed)
+		if op in ('insert', 'finger_insert'):
+			record(op, bench_insert(cls, n, dist, rng, op == 'finger_insert'))
+		elif op in ('search', 'finger_search'):
+			record(op, bench_search(cls, n, dist, rng, op == 'finger_search'))
+		elif op == 'delete':
+			record(op, bench_delete(cls, n, dist, rng))
+		elif op == 'churn':
+			record(op, bench_churn(cls, n, dist, rng, pool))
+		elif op == 'split' and 'join' in ops:
+			continue  # measured together with join
+		else:
+			split_res, join_res = bench_split_join(cls, n, dist, rng, min(trials, n))
+			if 'split' in ops:
+				record('split', split_res)
+			if 'join' in ops:
+				record('join', join_res)
+
+	return results
+
+
+"""lists the results that are slower than the baseline by more than the tolerance
+
+@type baseline: list
+@param baseline: results loaded from an earlier --output file
+@type tolerance: float
+@param tolerance: the allowed relative drop in ops_per_sec, e.g. 0.2 for 20%
+@rtype: list
+@returns: (result, baseline result) pairs
+"""
+def regressions(results, baseline, tolerance):
+	def result_key(res):
+		return res['op'], res.get('engine', 'avl'), res['dist'], res['n']
+
+	previous = dict((result_key(res), res) for res in baseline)
+	slower = []
+	for res in results:
+		old = previous.get(result_key(res))
+		if old is not None and res['ops_per_sec'] < old['ops_per_sec'] * (1 - tolerance):
+			slower.append((res, old))
+	return slower
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('-n', type=int, action='append', help='number of keys (repeatable)')
+	parser.add_argument('--dist', action='append', choices=DISTRIBUTIONS, help='key distribution (repeatable)')
+	parser.add_argument('--op', action='append', choices=OPERATIONS, help='operation (repeatable)')
+	parser.add_argument('--engine', action='append', choices=sorted(ENGINES), help='balancing engine (repeatable)')
+	parser.add_argument('--pool', type=int, default=0, help='node pool capacity for churn, 0 for none')
+	parser.add_argument('--trials', type=int, default=1000, help='split and join pairs per run')
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--json', action='store_true', help='print machine readable results')
+	parser.add_argument('--output', help='also write the results as json to this file')
+	parser.add_argument('--baseline', help='compare against results written earlier with --output')
+	parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative throughput drop')
+	args = parser.parse_args(argv)
+
+	results = []
+	for engine in args.engine or ['avl']:
+		for n in args.n or [10 ** 3, 10 ** 4, 10 ** 5]:
+			for dist in args.dist or DISTRIBUTIONS:
+				results.extend(run(engine, n, dist, args.op or OPERATIONS, args.seed, args.trials, args.pool))
+
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(results, f, indent=2)
+
+	if args.json:
+		print(json.dumps(results, indent=2))
+	else:
+		print('%-14s %-6s %-10s %9s %12s %9s %9s %9s %9s %8s %8s %8s %8s %6s %10s' % ('op', 'engine', 'dist', 'n',
+			'ops/s', 'p50 us', 'p99 us', 'p99.9 us', 'max us', 'path', 'promote', 'rotate', 'alloc', 'gc', 'gc max us'))
+		for res in results:
+			print('%-14s %-6s %-10s %9d %12.0f %9.2f %9.2f %9.2f %9.1f %8s %8s %8s %8s %6s %10s' % (res['op'], res['engine'],
+				res['dist'], res['n'], res['ops_per_sec'], res['p50_us'], res['p99_us'], res['p999_us'], res['max_us'],
+				'%.2f' % res['avg_path'] if 'avg_path' in res else '-',
+				'%.2f' % res['avg_promotions'] if 'avg_promotions' in res else '-',
+				'%.2f' % res['avg_rotations'] if 'avg_rotations' in res else '-',
+				'%.2f' % res['avg_allocations'] if 'avg_allocations' in res else '-',
+				res.get('gc_collections', '-'),
+				'%.1f' % res['gc_pause_max_us'] if 'gc_pause_max_us' in res else '-'))
+
+	if args.baseline:
+		with open(args.baseline) as f:
+			slower = regressions(results, json.load(f), args.tolerance)
+		for res, old in slower:
+			print('REGRESSION %s %s %s n=%d: %.0f ops/s, baseline %.0f ops/s' % (res['op'], res['engine'], res['dist'], res['n'],
+				res['ops_per_sec'], old['ops_per_sec']), file=sys.stderr)
+		if slower:
+			sys.exit(1)
+
+
+if __name__ == '__main__':
+	main()